@@ -0,0 +1,125 @@
+"""
+Admission control for LLM requests from the Telegram bot.
+
+Each user has at most one request in flight; further messages from the same
+user queue behind it in arrival order. Across users at most max_concurrent
+requests run at once, on a bounded thread pool, and at most max_pending are
+admitted (running or queued) before new ones are turned away. A running
+request can be cancelled, by the user or when it times out.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Raised when max_pending requests are already admitted."""
+
+
+@dataclass
+class QueueWaits:
+    """How long one user's requests waited before running, in seconds."""
+
+    count: int = 0
+    total_s: float = 0.0
+    max_s: float = 0.0
+    last_s: float = 0.0
+
+    def record(self, wait_s: float):
+        self.count += 1
+        self.total_s += wait_s
+        self.max_s = max(self.max_s, wait_s)
+        self.last_s = wait_s
+
+
+class RequestDispatcher:
+    """Per-user serialization and global limits for blocking LLM calls."""
+
+    def __init__(self, max_concurrent: int = 1, max_pending: int = 32):
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        # Blocking work of running requests goes here: per request, one thread
+        # generating and one consuming its output
+        self.executor = ThreadPoolExecutor(2 * max_concurrent, thread_name_prefix="llm")
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._user_locks: dict[int, asyncio.Lock] = {}
+        self._user_pending: dict[int, int] = {}
+        self._cancel: dict[int, threading.Event] = {}
+        self.pending = 0
+        self.running = 0
+        self.rejected = 0
+        self.waits: dict[int, QueueWaits] = {}
+
+    @asynccontextmanager
+    async def slot(self, user_id: int) -> AsyncIterator[threading.Event]:
+        """
+        Wait for the user's turn and a free slot, then run the block.
+
+        Yields an event that is set when the request should stop. Raises
+        Overloaded without waiting when too many requests are pending.
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded(f"{self.pending} requests already pending")
+        self.pending += 1
+        self._user_pending[user_id] = self._user_pending.get(user_id, 0) + 1
+        lock = self._user_locks.setdefault(user_id, asyncio.Lock())
+        enqueued = time.perf_counter()
+        try:
+            async with lock, self._slots:
+                wait_s = time.perf_counter() - enqueued
+                self.waits.setdefault(user_id, QueueWaits()).record(wait_s)
+                logger.info(f"User {user_id} request waited {wait_s * 1000:.0f}ms in queue")
+                cancel = threading.Event()
+                self._cancel[user_id] = cancel
+                self.running += 1
+                try:
+                    yield cancel
+                finally:
+                    # Stop whatever still runs for the request, e.g. when the
+                    # block raised while the model was generating.
+                    cancel.set()
+                    self.running -= 1
+                    del self._cancel[user_id]
+        finally:
+            self.pending -= 1
+            self._user_pending[user_id] -= 1
+            if not self._user_pending[user_id]:
+                del self._user_pending[user_id]
+                del self._user_locks[user_id]
+
+    def would_wait(self, user_id: int) -> bool:
+        """Whether a new request from the user would queue before running."""
+        if self.pending >= self.max_pending:
+            return False  # it would be turned away instead
+        return user_id in self._user_pending or self.pending >= self.max_concurrent
+
+    def cancel(self, user_id: int) -> bool:
+        """Stop the user's running request, if any."""
+        event = self._cancel.get(user_id)
+        if event is None:
+            return False
+        event.set()
+        return True
+
+    def describe(self, user_id: int | None = None) -> str:
+        text = (
+            f"llm: running={self.running}/{self.max_concurrent} "
+            f"pending={self.pending}/{self.max_pending} rejected={self.rejected}"
+        )
+        waits = self.waits.get(user_id)
+        if waits is not None:
+            text += (
+                f"\nyour queue wait: last={waits.last_s:.1f}s "
+                f"avg={waits.total_s / waits.count:.1f}s max={waits.max_s:.1f}s "
+                f"over {waits.count} requests"
+            )
+        return text
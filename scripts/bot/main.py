@@ -1,6 +1,16 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    BitsAndBytesConfig,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
 import torch
 import logging
+import threading
+
+from chat_common.history import ChatHistory, summary_prompt, token_counter
 
 # Configure logging
 logging.basicConfig(
@@ -9,6 +19,12 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 checkpoint = "LiquidAI/LFM2.5-1.2B-Instruct"
+max_new_tokens = 4096
+# Prompt budget per conversation: past it, old turns are folded into a summary
+# (or just dropped with summarize_history = False)
+max_history_tokens = 8192
+summarize_history = True
+summary_max_tokens = 256
 
 quantization_config = BitsAndBytesConfig(
     load_in_4bit=True,
@@ -22,21 +38,81 @@ model = AutoModelForCausalLM.from_pretrained(
     checkpoint, device_map="cuda:3", quantization_config=quantization_config
 )
 
-messages = [
-    {
-        "role": "system",
-        "content": "You are a general knowledge assistant, answering in a cheerful mood",
-    }
-]
+system_prompt = "You are a general knowledge assistant, answering in a cheerful mood"
+
+
+def summarize(summary, dropped):
+    """Fold dropped turns into the conversation's running summary."""
+    inputs = tokenizer.apply_chat_template(
+        summary_prompt(summary, dropped),
+        return_tensors="pt",
+        return_dict=True,
+        add_generation_prompt=True,
+        tokenize=True,
+    ).to(model.device)
+    with generate_lock:
+        outputs = model.generate(**inputs, max_new_tokens=summary_max_tokens)
+    return tokenizer.decode(
+        outputs[0][inputs["input_ids"].shape[1] :], skip_special_tokens=True
+    )
+
+
+def new_conversation():
+    """An empty conversation history kept under max_history_tokens."""
+    return ChatHistory(
+        system_prompt,
+        token_counter(tokenizer),
+        max_tokens=max_history_tokens,
+        summarize=summarize if summarize_history else None,
+    )
+
+
+messages = new_conversation()
+
+# One generation at a time on the model
+generate_lock = threading.Lock()
 
 
 def get_response(user_input, conversation_history):
-    """Get response from LLM for given user input and conversation history."""
+    """Get response from LLM for given user input and conversation history (a ChatHistory)."""
+    return "".join(stream_response(user_input, conversation_history))
+
+
+class CancelGeneration(StoppingCriteria):
+    """Stop generating as soon as the event is set."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full(
+            (input_ids.shape[0],),
+            self.event.is_set(),
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
+
+
+def stream_response(user_input, conversation_history, cancel=None, executor=None):
+    """
+    Like get_response, yielding the reply in pieces as it is generated.
+
+    The reply is added to the conversation history once the iterator is
+    exhausted. Setting the cancel event (a threading.Event) ends the reply
+    early, with what was generated so far. model.generate runs on executor
+    when given (a bounded pool), on a new thread otherwise.
+    """
     logger.debug(f"Generating response for user input: {user_input}")
-    conversation_history.append({"role": "user", "content": user_input})
+    conversation_history.append("user", user_input)
+    dropped = conversation_history.fit()
+    if dropped:
+        logger.debug(
+            f"Trimmed {len(dropped)} old messages, history is now "
+            f"~{conversation_history.tokens} tokens"
+        )
 
     inputs = tokenizer.apply_chat_template(
-        conversation_history,
+        conversation_history.messages,
         return_tensors="pt",
         return_dict=True,
         add_generation_prompt=True,
@@ -46,17 +122,46 @@ def get_response(user_input, conversation_history):
     inputs_length = inputs["input_ids"].shape[1]
     logger.debug(f"Input tokens length: {inputs_length}")
 
-    outputs = model.generate(**inputs, max_new_tokens=4096)
+    streamer = TextIteratorStreamer(
+        tokenizer, skip_prompt=True, skip_special_tokens=True
+    )
+
+    stopping_criteria = StoppingCriteriaList()
+    if cancel is not None:
+        stopping_criteria.append(CancelGeneration(cancel))
+
+    def generate():
+        with generate_lock:
+            if cancel is not None and cancel.is_set():
+                streamer.end()
+                return
+            try:
+                model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    streamer=streamer,
+                    stopping_criteria=stopping_criteria,
+                )
+            except Exception:
+                logger.exception("LLM generation failed")
+                # Unblock the consumer, it would otherwise wait forever
+                streamer.end()
+
+    if executor is not None:
+        executor.submit(generate)
+    else:
+        threading.Thread(target=generate, daemon=True).start()
+
+    pieces = []
+    for piece in streamer:
+        pieces.append(piece)
+        yield piece
     logger.debug("LLM generation completed")
 
-    decoded_outputs = tokenizer.decode(
-        outputs[0][inputs_length:], skip_special_tokens=True
-    )
+    decoded_outputs = "".join(pieces)
     logger.debug(f"Generated response length: {len(decoded_outputs)}")
 
-    conversation_history.append({"role": "assistant", "content": decoded_outputs})
-
-    return decoded_outputs
+    conversation_history.append("assistant", decoded_outputs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+"""
+Persistent, bounded store of per-user conversations.
+
+Recently active conversations live in memory, least recently used first out,
+capped at max_in_memory. Every conversation is also kept in SQLite as a
+zlib-compressed JSON snapshot of its ChatHistory state, token counts included,
+so evicted or pre-restart conversations are loaded back on first access without
+re-tokenizing anything.
+
+All SQLite work runs on one dedicated thread, off the event loop: loads are
+awaited, writes are batched. Changed conversations are marked dirty with save()
+and written together every flush_interval_s in one transaction.
+
+delete() bumps the user's generation. Histories handed out by get() remember
+the generation they were loaded in, and save() ignores stale ones, so a reply
+that finishes after /clear can't bring the old conversation back.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from chat_common.history import ChatHistory
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id INTEGER PRIMARY KEY,
+    state BLOB NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def encode_state(history: ChatHistory) -> bytes:
+    return zlib.compress(json.dumps(history.state(), separators=(",", ":")).encode())
+
+
+def decode_state(blob: bytes) -> dict:
+    return json.loads(zlib.decompress(blob))
+
+
+class ConversationStore:
+    """LRU in-memory conversations backed by SQLite."""
+
+    def __init__(
+        self,
+        path: str,
+        new_conversation: Callable[[], ChatHistory],
+        max_in_memory: int = 1024,
+        flush_interval_s: float = 2.0,
+    ):
+        self.path = path
+        self.new_conversation = new_conversation
+        self.max_in_memory = max_in_memory
+        self.flush_interval_s = flush_interval_s
+        self._cache: OrderedDict[int, ChatHistory] = OrderedDict()
+        self._loading: dict[int, asyncio.Future] = {}
+        # user id -> encoded state waiting to be written, None to delete
+        self._pending: dict[int, bytes | None] = {}
+        self._dirty: set[int] = set()
+        # user id -> number of deletes, and the generation each history was loaded in
+        self._generations: dict[int, int] = {}
+        self._loaded_in: weakref.WeakKeyDictionary[ChatHistory, int] = (
+            weakref.WeakKeyDictionary()
+        )
+        self._db = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-db")
+        self._conn: sqlite3.Connection | None = None
+        self._flusher: asyncio.Task | None = None
+
+        self.loads = 0
+        self.writes = 0
+
+    async def start(self):
+        await self._run(self._open)
+        self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """Write everything still pending and close the database."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+        await self.flush()
+        await self._run(self._conn.close)
+        self._db.shutdown()
+
+    async def get(self, user_id: int) -> ChatHistory:
+        """The user's conversation, loaded from disk or created on first access."""
+        history = self._cache.get(user_id)
+        if history is not None:
+            self._cache.move_to_end(user_id)
+            return history
+        if user_id in self._loading:
+            return await asyncio.shield(self._loading[user_id])
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        generation = self._generations.get(user_id, 0)
+        try:
+            history = self.new_conversation()
+            if user_id in self._pending:
+                # Evicted but not written yet, the pending state is the latest.
+                blob = self._pending[user_id]
+            else:
+                blob = await self._run(self._read, user_id)
+                if self._generations.get(user_id, 0) != generation:
+                    # Deleted while we were reading, the row is gone.
+                    blob = None
+                    generation = self._generations[user_id]
+            self._loaded_in[history] = generation
+            if blob is not None:
+                history.load_state(decode_state(blob))
+                self.loads += 1
+            self._insert(user_id, history)
+            future.set_result(history)
+            return history
+        except BaseException as e:
+            future.set_exception(e)
+            # Waiters get the exception, nobody else needs to retrieve it.
+            future.exception()
+            raise
+        finally:
+            del self._loading[user_id]
+
+    def save(self, user_id: int, history: ChatHistory):
+        """Mark the user's conversation changed, it's written on the next flush."""
+        if self._loaded_in.get(history, 0) != self._generations.get(user_id, 0):
+            logger.debug(f"Not saving conversation of user {user_id}, it was deleted")
+            return
+        if user_id not in self._cache:
+            # Evicted while a reply was being generated.
+            self._insert(user_id, history)
+        self._dirty.add(user_id)
+
+    def delete(self, user_id: int):
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        self._cache.pop(user_id, None)
+        self._dirty.discard(user_id)
+        self._pending[user_id] = None
+
+    async def flush(self):
+        """Write all changed conversations in one transaction."""
+        for user_id in self._dirty:
+            self._pending[user_id] = encode_state(self._cache[user_id])
+        self._dirty.clear()
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await self._run(self._write, batch)
+        except Exception:
+            # Keep the batch for the next attempt, unless newer states arrived.
+            self._pending = {**batch, **self._pending}
+            raise
+        self.writes += len(batch)
+
+    def describe(self) -> str:
+        return (
+            f"conversations: in_memory={len(self._cache)}/{self.max_in_memory} "
+            f"dirty={len(self._dirty) + len(self._pending)} "
+            f"loaded={self.loads} written={self.writes}"
+        )
+
+    def _insert(self, user_id: int, history: ChatHistory):
+        self._cache[user_id] = history
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_in_memory:
+            evicted_id, evicted = self._cache.popitem(last=False)
+            if evicted_id in self._dirty:
+                self._dirty.discard(evicted_id)
+                self._pending[evicted_id] = encode_state(evicted)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Writing conversations failed")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db, fn, *args)
+
+    # Everything below runs on the database thread.
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+
+    def _read(self, user_id: int) -> bytes | None:
+        row = self._conn.execute(
+            "SELECT state FROM conversations WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, batch: dict[int, bytes | None]):
+        started = time.perf_counter()
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO conversations (user_id, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, "
+                "updated_at = excluded.updated_at",
+                [(uid, blob, now) for uid, blob in batch.items() if blob is not None],
+            )
+            self._conn.executemany(
+                "DELETE FROM conversations WHERE user_id = ?",
+                [(uid,) for uid, blob in batch.items() if blob is None],
+            )
+        logger.debug(
+            f"Wrote {len(batch)} conversations in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import logging
 from telegram import Update
@@ -21,7 +22,10 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Import your existing LLM functionality
-from main import messages, get_response
+from main import new_conversation, stream_response
+from chat_common.streaming import accumulate, stream_reply
+from store import ConversationStore
+from dispatch import Overloaded, RequestDispatcher
 
 # Get the Telegram token from environment variable
 TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
@@ -29,8 +33,22 @@ TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
 if not TELEGRAM_TOKEN:
     raise ValueError("TELEGRAM_TOKEN environment variable not set")
 
-# Global variable to store conversation history for each user
-user_conversations = {}
+# Conversation history for each user: recent ones in memory, all of them on disk
+CONVERSATION_DB = os.environ.get("CONVERSATION_DB", "conversations.sqlite3")
+MAX_CONVERSATIONS_IN_MEMORY = int(os.environ.get("MAX_CONVERSATIONS_IN_MEMORY", 1024))
+user_conversations = ConversationStore(
+    CONVERSATION_DB,
+    new_conversation,
+    max_in_memory=MAX_CONVERSATIONS_IN_MEMORY,
+)
+
+# LLM requests: one at a time per user and overall, at most LLM_MAX_PENDING
+# admitted, each stopped after LLM_TIMEOUT_S seconds. The model is
+# single-flight (main.generate_lock), so running more requests at once would
+# only have them wait on the lock, with their timeout already running.
+LLM_MAX_PENDING = int(os.environ.get("LLM_MAX_PENDING", 32))
+LLM_TIMEOUT_S = float(os.environ.get("LLM_TIMEOUT_S", 300))
+dispatcher = RequestDispatcher(max_concurrent=1, max_pending=LLM_MAX_PENDING)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -45,7 +63,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /help is issued."""
     logger.info(f"Received /help command from user {update.effective_user.id}")
     await update.message.reply_text(
-        "Send me a message and I will respond using the LLM. Type /start to restart or /clear to reset conversation."
+        "Send me a message and I will respond using the LLM. Type /start to restart, /clear to reset conversation, /cancel to stop the current answer or /stats to see the queue."
     )
 
 
@@ -53,8 +71,7 @@ async def clear_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Clear the conversation history for the user."""
     user_id = update.effective_user.id
     logger.info(f"Clearing conversation for user {user_id}")
-    if user_id in user_conversations:
-        del user_conversations[user_id]
+    user_conversations.delete(user_id)
     await update.message.reply_text(
         "Conversation cleared! I've forgotten our previous conversation."
     )
@@ -67,28 +84,90 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     logger.debug(f"Received message from user {user_id}: {user_input}")
 
-    # Initialize user conversation if not exists
-    if user_id not in user_conversations:
-        user_conversations[user_id] = messages.copy()
+    if dispatcher.would_wait(user_id):
+        await update.message.reply_text(
+            f"⏳ Queued, {dispatcher.pending} request(s) ahead of yours."
+        )
+    try:
+        async with dispatcher.slot(user_id) as cancel:
+            # Load the user's conversation, or start one
+            history = await user_conversations.get(user_id)
+
+            # Stream the LLM response back, editing one message as it grows
+            logger.info(f"Generating LLM response for user {user_id}")
+            timeout = asyncio.get_running_loop().call_later(LLM_TIMEOUT_S, cancel.set)
+            replied = False
+            try:
+                await stream_reply(
+                    update.message,
+                    accumulate(
+                        stream_response(
+                            user_input, history, cancel, executor=dispatcher.executor
+                        ),
+                        executor=dispatcher.executor,
+                    ),
+                )
+                replied = True
+            finally:
+                timeout.cancel()
+                if not replied and history.turns and history.turns[-1]["role"] == "user":
+                    # The reply failed before it was generated: drop the
+                    # unanswered message rather than keep it in the conversation.
+                    history.pop()
+                user_conversations.save(user_id, history)
+            if cancel.is_set():
+                await update.message.reply_text("⏹ Answer stopped.")
+    except Overloaded:
+        logger.warning(f"Rejected request from user {user_id}: queue is full")
+        await update.message.reply_text(
+            "🚦 Too many requests right now, please try again in a moment."
+        )
+
+
+async def cancel_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop the answer being generated for the user."""
+    user_id = update.effective_user.id
+    if not dispatcher.cancel(user_id):
+        await update.message.reply_text("Nothing to stop.")
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Report LLM queue state and the user's own queue wait times."""
+    await update.message.reply_text(
+        dispatcher.describe(update.effective_user.id)
+        + "\n"
+        + user_conversations.describe()
+    )
+
 
-    # Get response from LLM
-    logger.info(f"Generating LLM response for user {user_id}")
-    response = get_response(user_input, user_conversations[user_id])
+async def open_store(application: Application):
+    await user_conversations.start()
 
-    # Send response back to user
-    logger.debug(f"Sending response to user {user_id}")
-    await update.message.reply_text(response)
+
+async def close_store(application: Application):
+    await user_conversations.close()
 
 
 def main():
     """Start the bot."""
     # Create the Application and pass it your bot's token
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(open_store)
+        .post_shutdown(close_store)
+        # Handle updates concurrently, so /start, /clear and /cancel aren't
+        # stuck behind a long answer
+        .concurrent_updates(True)
+        .build()
+    )
 
     # Register command handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("clear", clear_conversation))
+    application.add_handler(CommandHandler("cancel", cancel_request))
+    application.add_handler(CommandHandler("stats", stats))
 
     # Register message handler
     application.add_handler(
@@ -0,0 +1,96 @@
+"""
+Tests for ConversationStore. Run with: python -m pytest test_store.py
+"""
+
+import asyncio
+
+from chat_common.history import ChatHistory
+from store import ConversationStore
+
+
+def new_conversation():
+    # Word count stands in for a tokenizer
+    return ChatHistory("You are a test bot", lambda text: len(text.split()))
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_saved_conversation_survives_reload(tmp_path):
+    path = str(tmp_path / "conversations.sqlite3")
+
+    async def write():
+        store = ConversationStore(path, new_conversation)
+        await store.start()
+        history = await store.get(1)
+        history.append("user", "hello there")
+        store.save(1, history)
+        await store.close()
+
+    async def read():
+        store = ConversationStore(path, new_conversation)
+        await store.start()
+        history = await store.get(1)
+        await store.close()
+        return history
+
+    run(write())
+    history = run(read())
+    assert history.turns == [{"role": "user", "content": "hello there"}]
+
+
+def test_save_after_delete_does_not_restore_conversation(tmp_path):
+    path = str(tmp_path / "conversations.sqlite3")
+
+    async def clear_during_reply():
+        store = ConversationStore(path, new_conversation)
+        await store.start()
+        history = await store.get(1)
+        history.append("user", "first")
+        store.save(1, history)
+        await store.flush()
+
+        # A reply is being generated with `history` when /clear comes in
+        history.append("user", "second")
+        store.delete(1)
+        store.save(1, history)
+        await store.flush()
+
+        fresh = await store.get(1)
+        assert fresh is not history
+        assert fresh.turns == []
+        await store.close()
+
+    async def reload():
+        store = ConversationStore(path, new_conversation)
+        await store.start()
+        history = await store.get(1)
+        await store.close()
+        return history
+
+    run(clear_during_reply())
+    assert run(reload()).turns == []
+
+
+def test_conversation_after_delete_is_saved(tmp_path):
+    path = str(tmp_path / "conversations.sqlite3")
+
+    async def main():
+        store = ConversationStore(path, new_conversation)
+        await store.start()
+        old = await store.get(1)
+        store.delete(1)
+        history = await store.get(1)
+        history.append("user", "new start")
+        store.save(1, history)
+        store.save(1, old)  # stale, ignored
+        await store.close()
+
+        store = ConversationStore(path, new_conversation)
+        await store.start()
+        history = await store.get(1)
+        await store.close()
+        return history
+
+    assert run(main()).turns == [{"role": "user", "content": "new start"}]
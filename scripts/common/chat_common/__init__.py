@@ -0,0 +1 @@
+"""Chat helpers shared by the Telegram bots in scripts/bot and scripts/transcribe."""
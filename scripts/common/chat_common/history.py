@@ -0,0 +1,156 @@
+"""
+Token-budgeted chat history.
+
+Keeps a conversation's messages together with each message's token count,
+counted once when the message is added, so the running prompt length is known
+without re-tokenizing the transcript. When the history goes over its budget the
+oldest turns are dropped, or folded into a running summary that rides along in
+the system prompt. The system prompt and the latest message are always kept.
+
+Trimming goes down to a fraction of the budget (trim_to) rather than just under
+it, so it happens once every few turns and the prompt prefix, and with it any
+cached key/values, stays stable in between.
+
+Used by both Telegram bots, scripts/bot and scripts/transcribe.
+"""
+
+from typing import Callable
+
+Message = dict[str, str]
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation below in a few sentences. Keep names, facts, "
+    "decisions and open questions the assistant needs to continue it, and leave "
+    "out greetings and filler. Reply with the summary only."
+)
+
+
+def token_counter(tokenizer) -> Callable[[str], int]:
+    """Count the tokens of a message's text with a Hugging Face tokenizer."""
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def summary_prompt(summary: str | None, dropped: list[Message]) -> list[Message]:
+    """Messages asking the model to fold the dropped turns into the running summary."""
+    lines = []
+    if summary:
+        lines.append(f"Earlier summary: {summary}")
+    lines += [f"{m['role']}: {m['content']}" for m in dropped]
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": "\n".join(lines)},
+    ]
+
+
+class ChatHistory:
+    """
+    A conversation kept under max_tokens prompt tokens.
+
+    Token counts are approximate: each message is its text plus a fixed
+    message_overhead for the chat template's role markers. summarize, when
+    set, is called with (previous summary, dropped messages) and returns the
+    new summary; without it old turns are simply dropped.
+    """
+
+    def __init__(
+        self,
+        system_msg: str,
+        count_tokens: Callable[[str], int],
+        max_tokens: int = 4096,
+        trim_to: float = 0.75,
+        message_overhead: int = 4,
+        summarize: Callable[[str | None, list[Message]], str] | None = None,
+    ):
+        self.system_msg = system_msg
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.trim_to = trim_to
+        self.message_overhead = message_overhead
+        self.summarize = summarize
+        self.clear()
+
+    def clear(self):
+        self.summary: str | None = None
+        self.turns: list[Message] = []
+        self._lengths: list[int] = []
+        self._system_tokens = self._count(self.system_msg)
+        self.tokens = self._system_tokens
+
+    @property
+    def system(self) -> Message:
+        content = self.system_msg
+        if self.summary:
+            content += f"\n\n{SUMMARY_HEADER}\n{self.summary}"
+        return {"role": "system", "content": content}
+
+    @property
+    def messages(self) -> list[Message]:
+        """The prompt: system message (with the summary, if any) and the kept turns."""
+        return [self.system] + self.turns
+
+    def append(self, role: str, content: str):
+        length = self._count(content)
+        self.turns.append({"role": role, "content": content})
+        self._lengths.append(length)
+        self.tokens += length
+
+    def pop(self) -> Message:
+        """Remove and return the latest message."""
+        self.tokens -= self._lengths.pop()
+        return self.turns.pop()
+
+    def fit(self) -> list[Message]:
+        """
+        Drop the oldest turns if the history is over budget and return them.
+
+        Turns are dropped down to trim_to of the budget, starting the kept
+        history on a user turn. Dropped turns go to summarize when it is set.
+        """
+        if self.tokens <= self.max_tokens:
+            return []
+        target = self.max_tokens * self.trim_to
+        tokens = self.tokens
+        drop = 0
+        # Always keep the latest message, it's the one being answered.
+        while drop < len(self.turns) - 1 and (
+            tokens > target or self.turns[drop]["role"] != "user"
+        ):
+            tokens -= self._lengths[drop]
+            drop += 1
+        dropped = self.turns[:drop]
+        del self.turns[:drop]
+        del self._lengths[:drop]
+        self.tokens = tokens
+        if dropped and self.summarize is not None:
+            self.set_summary(self.summarize(self.summary, dropped))
+        return dropped
+
+    def state(self) -> dict:
+        """A JSON-serializable snapshot, token counts included."""
+        return {
+            "summary": self.summary,
+            "turns": list(self.turns),
+            "lengths": list(self._lengths),
+        }
+
+    def load_state(self, state: dict):
+        """Restore a state() snapshot without re-tokenizing its messages."""
+        self.clear()
+        if state.get("summary"):
+            self.set_summary(state["summary"])
+        turns = list(state.get("turns", []))
+        lengths = list(state.get("lengths", []))
+        if len(lengths) != len(turns):
+            lengths = [self._count(m["content"]) for m in turns]
+        self.turns, self._lengths = turns, lengths
+        self.tokens += sum(lengths)
+
+    def set_summary(self, summary: str | None):
+        self.tokens -= self._system_tokens
+        self.summary = summary or None
+        self._system_tokens = self._count(self.system["content"])
+        self.tokens += self._system_tokens
+
+    def _count(self, text: str) -> int:
+        return self.count_tokens(text) + self.message_overhead
@@ -0,0 +1,158 @@
+"""
+Progressive Telegram replies for streamed generations.
+
+A reply is sent as soon as the first text arrives and then edited in place as
+more streams in. Edits are coalesced: a message is only edited once at least
+min_interval_s has passed and min_chars have been added since the last edit,
+which keeps well under Telegram's edit rate limits however fast tokens come.
+Replies longer than a Telegram message continue in a new message.
+
+Only reply_text() on the incoming message and edit_text() on the sent one are
+used, so any object with those two coroutines (e.g. a fake for testing) works.
+
+Used by both Telegram bots, scripts/bot and scripts/transcribe.
+"""
+
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Iterator
+
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Telegram's limit on the text of one message
+MAX_MESSAGE_CHARS = 4096
+# Appended to the text while it's still being generated
+CURSOR = " ▌"
+
+
+class ProgressiveReply:
+    """One streamed answer to a message, edited in place as it grows."""
+
+    def __init__(
+        self,
+        message,
+        min_interval_s: float = 1.0,
+        min_chars: int = 40,
+        parse_mode: str | None = None,
+    ):
+        self.message = message
+        self.min_interval_s = min_interval_s
+        self.min_chars = min_chars
+        self.parse_mode = parse_mode
+        self.sent = []
+        self.edits = 0
+        self.first_chunk_at: float | None = None
+        self._started = time.perf_counter()
+        self._offset = 0  # start of the current message within the full text
+        self._shown = ""  # text of the current message as last sent
+        self._next_edit_at = 0.0
+
+    async def update(self, text: str):
+        """Show the text generated so far, if the last edit was long enough ago."""
+        if not text.strip():
+            return
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.perf_counter() - self._started
+        await self._roll_over(text)
+        current = text[self._offset :]
+        if self.sent and self.sent[-1] is not None and (
+            time.perf_counter() < self._next_edit_at
+            or len(current) - len(self._shown) < self.min_chars
+        ):
+            return
+        await self._show(current + CURSOR, final=False)
+        self._shown = current
+
+    async def finish(self, text: str):
+        """Show the complete text, formatted with parse_mode."""
+        if not text.strip():
+            text = "…"
+        await self._roll_over(text)
+        await self._show(text[self._offset :], final=True)
+
+    async def _roll_over(self, text: str):
+        """Finish the current message and start a new one when the text outgrows it."""
+        while len(text) - self._offset > MAX_MESSAGE_CHARS - len(CURSOR):
+            end = self._split_point(text)
+            await self._show(text[self._offset : end], final=True)
+            self._offset, self._shown = end, ""
+            self.sent.append(None)  # the next _show sends a new message
+
+    def _split_point(self, text: str) -> int:
+        limit = self._offset + MAX_MESSAGE_CHARS - len(CURSOR)
+        newline = text.rfind("\n", self._offset, limit)
+        return newline + 1 if newline > self._offset else limit
+
+    async def _show(self, text: str, final: bool):
+        parse_mode = self.parse_mode if final else None
+        while True:
+            try:
+                await self._send_or_edit(text, parse_mode)
+                break
+            except RetryAfter as e:
+                if not final:
+                    # Skip this update and hold off the next ones.
+                    self._next_edit_at = time.perf_counter() + _seconds(e.retry_after)
+                    return
+                await asyncio.sleep(_seconds(e.retry_after))
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    break
+                if parse_mode is None:
+                    raise
+                # Generated markdown that Telegram can't parse, send it as is.
+                logger.warning(f"Falling back to plain text: {e}")
+                parse_mode = None
+        self._next_edit_at = time.perf_counter() + self.min_interval_s
+
+    async def _send_or_edit(self, text: str, parse_mode: str | None):
+        if not self.sent or self.sent[-1] is None:
+            sent = await self.message.reply_text(text, parse_mode=parse_mode)
+            if self.sent:
+                self.sent[-1] = sent
+            else:
+                self.sent.append(sent)
+        else:
+            await self.sent[-1].edit_text(text, parse_mode=parse_mode)
+            self.edits += 1
+
+
+def _seconds(retry_after) -> float:
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+async def stream_reply(message, chunks: AsyncIterator[str], **kwargs) -> str:
+    """
+    Reply to message with text streamed from chunks (each one the full text
+    so far) and return the final text. kwargs go to ProgressiveReply.
+    """
+    reply = ProgressiveReply(message, **kwargs)
+    text = ""
+    async for text in chunks:
+        await reply.update(text)
+    await reply.finish(text)
+    logger.info(
+        f"Streamed reply: first chunk after {(reply.first_chunk_at or 0) * 1000:.0f}ms, "
+        f"{len(text)} chars, {reply.edits} edits"
+    )
+    return text
+
+
+async def accumulate(deltas: Iterator[str], executor=None) -> AsyncIterator[str]:
+    """
+    Turn a blocking iterator of text pieces (e.g. a TextIteratorStreamer) into
+    an async iterator of the full text so far, without blocking the event loop.
+    The iterator is advanced on executor (the loop's default one if None).
+    """
+    loop = asyncio.get_running_loop()
+    text = ""
+    done = object()
+    while True:
+        piece = await loop.run_in_executor(executor, next, deltas, done)
+        if piece is done:
+            return
+        text += piece
+        yield text
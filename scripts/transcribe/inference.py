@@ -0,0 +1,215 @@
+"""
+Dedicated inference workers for the Telegram bot.
+
+Models are loaded once and every blocking model call runs on a worker thread
+fed by a FIFO queue, so async handlers only await the result and the bot's
+event loop keeps serving other users in the meantime. Each model gets its own
+worker: calls to one model are serialized (a GPU model isn't re-entrant) while
+different models (ASR, chat, diffusion) run concurrently.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StageStats:
+    """Running queue wait and execution time of one worker, in milliseconds."""
+
+    count: int = 0
+    errors: int = 0
+    wait_ms_total: float = 0.0
+    run_ms_total: float = 0.0
+    wait_ms_max: float = 0.0
+    run_ms_max: float = 0.0
+    last_run_ms: float = 0.0
+
+    def record(self, wait_ms: float, run_ms: float, failed: bool):
+        self.count += 1
+        self.errors += int(failed)
+        self.wait_ms_total += wait_ms
+        self.run_ms_total += run_ms
+        self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+        self.run_ms_max = max(self.run_ms_max, run_ms)
+        self.last_run_ms = run_ms
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "wait_ms_avg": round(self.wait_ms_total / self.count, 1) if self.count else 0.0,
+            "wait_ms_max": round(self.wait_ms_max, 1),
+            "run_ms_avg": round(self.run_ms_total / self.count, 1) if self.count else 0.0,
+            "run_ms_max": round(self.run_ms_max, 1),
+            "run_ms_last": round(self.last_run_ms, 1),
+        }
+
+
+@dataclass
+class _Job:
+    item: Any
+    future: asyncio.Future
+    loop: asyncio.AbstractEventLoop
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class InferenceWorker:
+    """
+    Base of the workers: a daemon thread serving a FIFO request queue.
+
+    Subclasses implement _loop, the thread's body, which takes jobs off
+    self._queue until it gets None.
+    """
+
+    def __init__(self, name: str, max_queue: int = 0):
+        self.name = name
+        self.stats = StageStats()
+        self._queue: queue.Queue[_Job | None] = queue.Queue(maxsize=max_queue)
+        self._busy = False
+        self._thread = threading.Thread(target=self._loop, name=f"{name}-worker", daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests waiting plus the one currently running."""
+        return self._queue.qsize() + int(self._busy)
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item on the worker thread and await its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = _Job(item, future, loop)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise RuntimeError(f"{self.name} queue is full ({self._queue.maxsize} pending)")
+        return await future
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def describe(self) -> str:
+        s = self.stats.as_dict()
+        return (
+            f"{self.name}: queue={self.queue_depth} done={s['count']} errors={s['errors']}\n"
+            f"  wait avg={s['wait_ms_avg']}ms max={s['wait_ms_max']}ms\n"
+            f"  run avg={s['run_ms_avg']}ms max={s['run_ms_max']}ms last={s['run_ms_last']}ms"
+        )
+
+
+def _set_result(future: asyncio.Future, result: Any):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, exc: BaseException):
+    if not future.done():
+        future.set_exception(exc)
+
+
+class BatchingWorker(InferenceWorker):
+    """
+    An inference worker that groups queued items into micro-batches.
+
+    The first queued item opens a batch window of max_wait_ms; the batch is
+    dispatched when the window closes or max_batch_size items have arrived,
+    whichever comes first. batch_fn maps a list of items to a list of results
+    in the same order, and each result is routed back to its caller.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        batch_fn: Callable[[list], list],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+        max_queue: int = 0,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batches = 0
+        self.batch_size_max = 0
+        self.batch_run_s_total = 0.0
+        super().__init__(name, max_queue)
+
+    def describe(self) -> str:
+        items = self.stats.count
+        avg_size = items / self.batches if self.batches else 0.0
+        throughput = items / self.batch_run_s_total if self.batch_run_s_total else 0.0
+        return (
+            super().describe()
+            + f"\n  batches={self.batches} avg_size={avg_size:.1f} max_size={self.batch_size_max}"
+            f" (cap={self.max_batch_size}, window={self.max_wait_ms:g}ms)"
+            f"\n  throughput={throughput:.1f} items/s of model time"
+        )
+
+    def _collect(self) -> list[_Job] | None:
+        """Block for the first job, then gather more until the window closes or the batch is full."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # Finish this batch, then stop.
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            batch = [job for job in batch if not job.future.cancelled()]
+            if not batch:
+                continue
+            self._busy = True
+            started = time.perf_counter()
+            failed = False
+            try:
+                results = self.batch_fn([job.item for job in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"{self.name}: batch of {len(batch)} returned {len(results)} results"
+                    )
+            except BaseException as e:
+                failed = True
+                for job in batch:
+                    job.loop.call_soon_threadsafe(_set_exception, job.future, e)
+            else:
+                for job, result in zip(batch, results):
+                    job.loop.call_soon_threadsafe(_set_result, job.future, result)
+            finally:
+                run_s = time.perf_counter() - started
+                for job in batch:
+                    self.stats.record((started - job.enqueued_at) * 1000, run_s * 1000, failed)
+                self.batches += 1
+                self.batch_size_max = max(self.batch_size_max, len(batch))
+                self.batch_run_s_total += run_s
+                self._busy = False
+                logger.info(
+                    f"{self.name}: batch of {len(batch)} ran {run_s * 1000:.0f}ms, "
+                    f"queue depth {self.queue_depth}"
+                )
+
+
+def format_stats(workers: list) -> str:
+    """Human readable queue depth and latency per worker (anything with describe()), for /stats."""
+    return "\n".join(worker.describe() for worker in workers)
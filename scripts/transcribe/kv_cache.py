@@ -0,0 +1,150 @@
+"""
+Per-conversation key/value cache reuse for the chat model.
+
+After each turn a conversation keeps the past key/values of everything the
+model has seen (the prompt plus its reply), so the next turn only prefills the
+tokens the chat template added since: the end of the reply and the new user
+message. Turn latency then depends on the new message, not on the length of the
+history.
+
+The cached tokens are matched against the freshly templated prompt: when the
+history was cleared, truncated or re-rendered differently the cache is cropped
+to the common prefix, or dropped when the cache can't be cropped (conv and
+linear-attention layers only hold the state after their last token). Entries
+are evicted least recently used first to stay within a memory budget.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import torch
+
+from scheduler import cache_to_tensors
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedPrefix:
+    """Past key/values of one conversation and the token ids they cover."""
+
+    token_ids: list[int]
+    past_key_values: object
+    nbytes: int
+
+
+def cache_nbytes(cache) -> int:
+    """Memory held by a cache's tensors, whatever its layer types."""
+    seen = set()
+    total = 0
+    stack = [cache]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, torch.Tensor):
+            if obj.data_ptr() not in seen:
+                seen.add(obj.data_ptr())
+                total += obj.numel() * obj.element_size()
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__") and (obj is cache or type(obj).__module__.startswith("transformers")):
+            stack.extend(vars(obj).values())
+    return total
+
+
+def common_prefix_len(a: list[int], b: list[int]) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class ConversationCache:
+    """LRU store of per-conversation past key/values under a memory budget."""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.nbytes = 0
+        self._entries: OrderedDict[object, CachedPrefix] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused_tokens = 0
+        self.prompt_tokens = 0
+
+    def take(self, key, token_ids: list[int]) -> tuple[object | None, int]:
+        """
+        Remove key's entry and return (past_key_values, cached length) usable
+        as a prefix of token_ids, or (None, 0) when nothing can be reused.
+
+        The caller owns the returned cache (generation extends it in place)
+        and hands the extended one back with put().
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry.nbytes
+        self.prompt_tokens += len(token_ids)
+        past_key_values, length = self._reusable(entry, token_ids)
+        if past_key_values is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.reused_tokens += length
+        return past_key_values, length
+
+    def _reusable(self, entry: CachedPrefix | None, token_ids: list[int]) -> tuple[object | None, int]:
+        if entry is None:
+            return None, 0
+        # At least one token has to be prefilled to get next-token logits.
+        common = min(common_prefix_len(entry.token_ids, token_ids), len(token_ids) - 1)
+        if common == len(entry.token_ids):
+            return entry.past_key_values, common
+        if common > 0 and cache_to_tensors(entry.past_key_values) is not None:
+            # Negative: drop that many tokens from the end.
+            entry.past_key_values.crop(common - len(entry.token_ids))
+            return entry.past_key_values, common
+        return None, 0
+
+    def put(self, key, token_ids: list[int], past_key_values):
+        """Store the cache covering token_ids for key, evicting older conversations as needed."""
+        nbytes = cache_nbytes(past_key_values)
+        if nbytes > self.budget_bytes:
+            logger.info(f"KV cache of {nbytes / 2**20:.0f}MB exceeds the budget, not kept")
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._entries[key] = CachedPrefix(list(token_ids), past_key_values, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.budget_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def drop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def describe(self) -> str:
+        reused = self.reused_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        return (
+            f"kv cache: conversations={len(self._entries)} "
+            f"size={self.nbytes / 2**20:.0f}/{self.budget_bytes / 2**20:.0f}MB\n"
+            f"  hits={self.hits} misses={self.misses} evictions={self.evictions}"
+            f" reused={reused:.0%} of prompt tokens"
+        )
@@ -5,17 +5,29 @@ Telegram Bot for handling voice recordings.
 This bot:
 - Accepts a /start command to initiate conversation
 - Waits for audio voice recordings from users
-- Saves recorded audio to a configured folder with timestamp as filename
+- Decodes them in memory (or via a temporary file in the configured folder)
+- Transcribes them and answers with the chat model
+- Generates images for /image prompts
+- Loads each model on first use and unloads the ones left idle
 """
 
-from models import Chat, Transcriber, Diffuser
+from models import Chat, Transcriber, Diffuser, ImageRequest
+from inference import BatchingWorker, format_stats
+from registry import ModelRegistry
+from chat_common.streaming import stream_reply
 
+import asyncio
+import io
 import logging
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import Final
 
-from telegram import Update, Voice
+import numpy as np
+from telegram import File, Message, Update, Voice
+from telegram.constants import ParseMode
+from telegram.error import TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -30,6 +42,47 @@ env = dotenv_values(dotenv_path=".env")
 # Configuration
 TOKEN: Final = env.get("TELEGRAM_TOKEN")
 DEFAULT_DOWNLOAD_FOLDER: Final = env.get("DOWNLOAD_FOLDER")
+# "memory" decodes voice notes without touching disk, "disk" forces the ffmpeg/.wav path
+VOICE_DECODE: Final = env.get("VOICE_DECODE", "memory")
+# Concurrent voice notes are transcribed together: a batch is sent once it has
+# ASR_BATCH_SIZE clips or ASR_BATCH_WAIT_MS after its first clip arrived
+ASR_BATCH_SIZE: Final = int(env.get("ASR_BATCH_SIZE", 8))
+ASR_BATCH_WAIT_MS: Final = float(env.get("ASR_BATCH_WAIT_MS", 20))
+# Max conversations decoded together in one forward pass
+CHAT_BATCH_SIZE: Final = int(env.get("CHAT_BATCH_SIZE", 8))
+# GPU memory kept for past key/values of recent conversations (LRU)
+CHAT_KV_CACHE_MB: Final = int(env.get("CHAT_KV_CACHE_MB", 1024))
+# Prompt token budget per conversation; older turns are dropped, or summarized
+# when CHAT_SUMMARIZE_HISTORY is set
+CHAT_MAX_HISTORY_TOKENS: Final = int(env.get("CHAT_MAX_HISTORY_TOKENS", 4096))
+CHAT_SUMMARIZE_HISTORY: Final = env.get("CHAT_SUMMARIZE_HISTORY", "0") == "1"
+# Streamed replies are edited at most every STREAM_EDIT_INTERVAL_S seconds and
+# only once STREAM_EDIT_MIN_CHARS new characters have arrived
+STREAM_EDIT_INTERVAL_S: Final = float(env.get("STREAM_EDIT_INTERVAL_S", 1.0))
+STREAM_EDIT_MIN_CHARS: Final = int(env.get("STREAM_EDIT_MIN_CHARS", 40))
+# Diffusion pipeline placement: auto, resident, model or sequential (CPU offload).
+# auto fits the weights to DIFFUSER_MEMORY_GB, or the GPU's free memory when the
+# pipeline is loaded
+DIFFUSER_PLACEMENT: Final = env.get("DIFFUSER_PLACEMENT", "auto")
+DIFFUSER_MEMORY_GB: Final = (
+    float(env["DIFFUSER_MEMORY_GB"]) if env.get("DIFFUSER_MEMORY_GB") else None
+)
+# Concurrent /image prompts of the same size are generated in one pipeline call
+IMAGE_BATCH_SIZE: Final = int(env.get("IMAGE_BATCH_SIZE", 4))
+IMAGE_BATCH_WAIT_MS: Final = float(env.get("IMAGE_BATCH_WAIT_MS", 200))
+# Minimum time between edits of an /image progress message
+IMAGE_PROGRESS_INTERVAL_S: Final = float(env.get("IMAGE_PROGRESS_INTERVAL_S", 1.0))
+# Models are loaded on first use. Idle ones are unloaded, least recently used
+# first, when loading another would go over MODEL_MEMORY_GB, and after
+# MODEL_IDLE_EVICT_S seconds without use (0 keeps them loaded)
+MODEL_MEMORY_GB: Final = (
+    float(env["MODEL_MEMORY_GB"]) if env.get("MODEL_MEMORY_GB") else None
+)
+MODEL_IDLE_EVICT_S: Final = float(env.get("MODEL_IDLE_EVICT_S", 900))
+# Comma-separated models (asr, chat, image) to load at startup instead
+PRELOAD_MODELS: Final = [
+    name.strip() for name in env.get("PRELOAD_MODELS", "").split(",") if name.strip()
+]
 
 # Enable logging first before any other logging calls
 logging.basicConfig(
@@ -38,21 +91,52 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load models
+# Models, loaded on demand through the registry
 chat = Chat(
     # checkpoint="Qwen/Qwen3.5-0.8B", - requires transformers upgrade
     quantization=False,
     device="cuda:0",
     max_new_tokens=1024,
+    kv_cache_mb=CHAT_KV_CACHE_MB,
+    max_history_tokens=CHAT_MAX_HISTORY_TOKENS,
+    summarize_history=CHAT_SUMMARIZE_HISTORY,
     system_msg="You are an assistant that provide concise responses to fit a mobile phone chat, usually using markdown to enrich the text",
 )
-chat.load_model()
-
 transcriber = Transcriber(device="cuda:0")
-transcriber.load_model()
 
-diffuser = Diffuser(device="cuda:0")
-diffuser.load_model()
+diffuser = Diffuser(
+    device="cuda:0",
+    placement=DIFFUSER_PLACEMENT,
+    memory_budget_gb=DIFFUSER_MEMORY_GB,
+    max_batch_size=IMAGE_BATCH_SIZE,
+)
+
+
+def load_chat():
+    chat.load_model()
+    chat.start_scheduler(max_batch_size=CHAT_BATCH_SIZE)
+
+
+registry = ModelRegistry(memory_budget_gb=MODEL_MEMORY_GB, idle_evict_s=MODEL_IDLE_EVICT_S)
+registry.register("asr", transcriber.load_model, transcriber.unload)
+registry.register("chat", load_chat, chat.unload)
+registry.register("image", diffuser.load_model, diffuser.unload)
+
+# One worker per model: calls to the same model are serialized, everything
+# else (other models, Telegram I/O) keeps running on the event loop. The chat
+# model has its own continuous-batching scheduler thread.
+asr_worker = BatchingWorker(
+    "asr",
+    transcriber.transcribe_batch,
+    max_batch_size=min(ASR_BATCH_SIZE, transcriber.max_batch_size),
+    max_wait_ms=ASR_BATCH_WAIT_MS,
+)
+image_worker = BatchingWorker(
+    "image",
+    diffuser.generate_batch,
+    max_batch_size=IMAGE_BATCH_SIZE,
+    max_wait_ms=IMAGE_BATCH_WAIT_MS,
+)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -63,14 +147,23 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
-async def handle_voice_message(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
-    """Handle incoming voice messages and save them to disk."""
-    voice: Voice = update.message.voice
+async def decode_voice_in_memory(file: File, timings: dict) -> tuple[np.ndarray, int]:
+    """Download a voice note into memory and decode it straight to float32 PCM."""
+    stage_start = time.perf_counter()
+    ogg_bytes = bytes(await file.download_as_bytearray())
+    timings["download"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    audio = await asyncio.to_thread(transcriber.decode_ogg, ogg_bytes)
+    timings["decode"] = time.perf_counter() - stage_start
+    return audio
+
 
-    # Get the file
-    file = await voice.get_file()
+async def decode_voice_via_disk(
+    file: File, voice: Voice, context: ContextTypes.DEFAULT_TYPE, timings: dict
+) -> bytes:
+    """Fallback path: save the .ogg, convert it to .wav with ffmpeg and read it back."""
+    stage_start = time.perf_counter()
 
     # Generate filename with timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -90,71 +183,135 @@ async def handle_voice_message(
 
     # Download the file
     await file.download_to_drive(file_path)
+    timings["download"] = time.perf_counter() - stage_start
 
     logger.info(f"Voice message saved to: {file_path}")
 
-    # Convert ogg to wav
+    wav_path = None
     try:
-        wav_path = transcriber._convert_ogg_to_wav(
-            ogg_path=file_path, output_dir=download_folder
+        # Convert ogg to wav, pydub shells out to ffmpeg so keep it off the event loop
+        stage_start = time.perf_counter()
+        wav_path = await asyncio.to_thread(
+            transcriber._convert_ogg_to_wav,
+            ogg_path=file_path,
+            output_dir=download_folder,
         )
         logger.info(f"Converted to WAV: {wav_path}")
+        wav_bytes = wav_path.read_bytes()
+        timings["decode"] = time.perf_counter() - stage_start
+        return wav_bytes
+    finally:
+        # Clean up audio files after processing (whether successful or failed)
+        for path in (file_path, wav_path):
+            if path is None:
+                continue
+            try:
+                path.unlink()
+                logger.info(f"Cleaned up {path.suffix} file: {path}")
+            except FileNotFoundError:
+                logger.warning(f"Could not clean up {path.suffix} file: {path} - not found")
 
-        # Send the converted wav file
-        # await update.message.reply_document(wav_path)
 
-        if transcriber.model:
-            try:
-                # Read the wav file and transcribe
-                wav_bytes = wav_path.read_bytes()
-                transcribed_lang, transcribed_text = transcriber.transcribe(wav_bytes)
+async def handle_voice_message(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Transcribe incoming voice messages and answer them with the chat model."""
+    voice: Voice = update.message.voice
+    timings = {}
 
-                # Send the transcribed text
-                await update.message.reply_text(
-                    f"📝 Transcribed text ({transcribed_lang}):\n{transcribed_text}"
-                )
-                model_msg = chat.generate(transcribed_text)
-                await update.message.reply_markdown(
-                    text=model_msg,
-                )
-            finally:
-                # Clean up audio files after processing (whether successful or failed)
-                try:
-                    file_path.unlink()  # Delete .ogg file
-                    logger.info(f"Cleaned up .ogg file: {file_path}")
-                except FileNotFoundError:
-                    logger.warning(
-                        f"Could not clean up .ogg file: {file_path} - not found"
-                    )
-
-                try:
-                    wav_path.unlink()  # Delete .wav file
-                    logger.info(f"Cleaned up .wav file: {wav_path}")
-                except FileNotFoundError:
-                    logger.warning(
-                        f"Could not clean up .wav file: {wav_path} - not found"
-                    )
-        else:
-            logger.warning("ASR model not loaded")
+    try:
+        # Get the file
+        file = await voice.get_file()
+
+        audio = None
+        if VOICE_DECODE == "memory":
+            try:
+                audio = await decode_voice_in_memory(file, timings)
+            except Exception as e:
+                logger.warning(f"In-memory decode failed ({e}), falling back to disk")
+        if audio is None:
+            audio = await decode_voice_via_disk(file, voice, context, timings)
+
+        stage_start = time.perf_counter()
+        async with registry.use("asr"):
+            transcribed_lang, transcribed_text = await asr_worker.submit(audio)
+        timings["asr"] = time.perf_counter() - stage_start
+
+        # Send the transcribed text
+        await update.message.reply_text(
+            f"📝 Transcribed text ({transcribed_lang}):\n{transcribed_text}"
+        )
+        stage_start = time.perf_counter()
+        async with registry.use("chat"):
+            await stream_reply(
+                update.message,
+                chat.session(update.effective_chat.id).stream(transcribed_text),
+                min_interval_s=STREAM_EDIT_INTERVAL_S,
+                min_chars=STREAM_EDIT_MIN_CHARS,
+                parse_mode=ParseMode.MARKDOWN,
+            )
+        timings["chat"] = time.perf_counter() - stage_start
+        logger.info(
+            "Voice pipeline: "
+            + " ".join(f"{k}={v * 1000:.0f}ms" for k, v in timings.items())
+        )
     except Exception as e:
         logger.error(f"Processing failed: {e}")
         await update.message.reply_text(f"⚠️ An error occurred: {str(e)}")
 
 
 async def clear(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat.clear()
+    # No session yet means nothing to clear, and no need to load the chat model
+    session = chat.sessions.get(update.effective_chat.id)
+    if session is not None:
+        session.clear()
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Report loaded models, inference queue depth and per-stage latency."""
+    workers = [asr_worker, image_worker, chat.kv_cache, diffuser]
+    if chat.scheduler is not None:
+        workers.insert(1, chat.scheduler)
+    await update.message.reply_text(format_stats([registry] + workers))
+
+
+def encode_png(image) -> bytes:
+    with io.BytesIO() as buffer:
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+def image_progress(status: Message, loop: asyncio.AbstractEventLoop):
+    """
+    A pipeline progress callback editing the status message, at most every
+    IMAGE_PROGRESS_INTERVAL_S seconds (the last step is always shown).
+    """
+    last_edit = 0.0
+
+    async def show(step: int, total: int):
+        nonlocal last_edit
+        now = time.perf_counter()
+        if step < total and now - last_edit < IMAGE_PROGRESS_INTERVAL_S:
+            return
+        last_edit = now
+        text = f"🪩 Generating image... step {step}/{total}"
+        if step == total:
+            text = "🖼️ Encoding image..."
+        try:
+            await status.edit_text(text)
+        except TelegramError as e:
+            logger.debug(f"Progress update skipped: {e}")
+
+    def on_progress(step: int, total: int):
+        # Called from the image worker thread
+        asyncio.run_coroutine_threadsafe(show(step, total), loop)
+
+    return on_progress
 
 
 async def generate_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Generate an image from the user's prompt and send it back to the chat."""
     try:
-        # Load diffuser model if not already loaded
-        if not diffuser._model_loaded:
-            await update.message.reply_text(
-                "📨 Loading diffusion model... (this may take a moment)"
-            )
-            diffuser.load_model()
-
         # Get the text prompt from user
         prompt = update.message.text.strip()
 
@@ -169,36 +326,56 @@ async def generate_image(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
             return
 
-        await update.message.reply_text(
+        ahead = image_worker.queue_depth
+        status = await update.message.reply_text(
             "🪩 Generating image... (this may take a moment)"
+            + ("" if diffuser._model_loaded else "\n📨 Loading diffusion model first")
+            + (f"\n⏳ {ahead} image(s) ahead in the queue" if ahead else "")
         )
 
-        # Generate filename with timestamp in /tmp folder
-        from datetime import datetime
-
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_path = f"/tmp/{timestamp}.png"
-
-        # Generate the image using diffuser
-        diffuser.generate(
-            prompt=prompt,
-            image_path=output_path,
-            height=1024,
-            width=1024,
-        )
+        # Generate the image using diffuser, batched with other users' prompts.
+        # The handler only awaits the worker, so voice and chat keep flowing and
+        # users can queue several prompts.
+        async with registry.use("image"):
+            image = await image_worker.submit(
+                ImageRequest(
+                    prompt=prompt,
+                    height=1024,
+                    width=1024,
+                    on_progress=image_progress(status, asyncio.get_running_loop()),
+                )
+            )
 
-        await update.message.reply_document(document=output_path)
-        logger.info(f"Image generated and sent to user: {output_path}")
+        # Upload straight from memory, named after the request so names never clash
+        png = await asyncio.to_thread(encode_png, image)
+        filename = f"image-{update.effective_chat.id}-{update.message.message_id}.png"
+        await update.message.reply_document(document=png, filename=filename)
+        await status.edit_text("✅ Image ready")
+        logger.info(f"Image generated and sent to user: {filename} ({len(png)} bytes)")
 
     except Exception as e:
         logger.error(f"Image generation failed: {e}")
         await update.message.reply_text(f"⚻️ Image generation failed: {str(e)}")
 
 
+async def post_init(application: Application) -> None:
+    registry.start()
+    if PRELOAD_MODELS:
+        await registry.preload(*PRELOAD_MODELS)
+
+
 def main() -> None:
     """Start the bot."""
     # Create the Application and pass it your bot's token
-    application = Application.builder().token(TOKEN).build()
+    # Handlers only await the inference workers, so let updates from different
+    # users be processed concurrently instead of one at a time.
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .build()
+    )
 
     # Add command handler for /start
     application.add_handler(CommandHandler("start", start))
@@ -209,6 +386,7 @@ def main() -> None:
     )
     application.add_handler(CommandHandler("clear", clear))
     application.add_handler(CommandHandler("image", generate_image))
+    application.add_handler(CommandHandler("stats", stats))
 
     # Run the bot until the user presses Ctrl-C
     logger.info("Bot started. Press Ctrl-C to stop.")
@@ -1,49 +1,215 @@
 from qwen_asr import Qwen3ASRModel
 from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 from diffusers import Flux2KleinPipeline
+from scheduler import ChatScheduler
+from kv_cache import ConversationCache
+from chat_common.history import ChatHistory, summary_prompt, token_counter
 import torch
 
+import asyncio
+import inspect
+import logging
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
 import soundfile as sf
 import numpy as np
 import io
 from pydub import AudioSegment
-from typing import AnyStr, Tuple
+from typing import AnyStr, AsyncIterator, Callable, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# kv_cache key of the single conversation behind Chat.generate/Chat.clear
+DEFAULT_CONVERSATION = "default"
+
+
+@dataclass
+class ImageRequest:
+    prompt: str
+    height: int = 1024
+    width: int = 1024
+    seed: int = 0
+    # Called from the worker thread with (steps done, total steps)
+    on_progress: Callable[[int, int], None] | None = field(
+        default=None, compare=False, repr=False
+    )
 
 
 class Diffuser:
+    """
+    Text-to-image pipeline with a placement chosen once at load time.
+
+    "resident" keeps every component on the GPU, "model" offloads whole
+    components to the CPU between uses and "sequential" streams weights layer
+    by layer (slowest, smallest footprint). "auto" picks the fastest one whose
+    weights fit memory_budget_gb, or the GPU's free memory when unset.
+    """
+
+    # Weights plus room for activations and the VAE decode
+    headroom = 1.25
+
     def __init__(
         self,
         checkpoint: str = "black-forest-labs/FLUX.2-klein-4B",
         device: str = "auto",
+        placement: str = "auto",
+        memory_budget_gb: float | None = None,
+        max_batch_size: int = 4,
+        num_inference_steps: int = 4,
+        guidance_scale: float = 4.0,
     ):
         self.checkpoint = checkpoint
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
         self.device = device
+        self.placement = placement
+        self.memory_budget_gb = memory_budget_gb
+        self.max_batch_size = max_batch_size
+        self.num_inference_steps = num_inference_steps
+        self.guidance_scale = guidance_scale
         self.dtype = torch.bfloat16
         self._model_loaded = False
 
+        self.batches = 0
+        self.images = 0
+        self.step_ms_total = 0.0
+        self.steps = 0
+        self.last_step_ms: list[float] = []
+
     def load_model(self):
         self.pipe = Flux2KleinPipeline.from_pretrained(
             self.checkpoint, torch_dtype=self.dtype
         )
+        self.placement = self._place(self.placement)
+        self._step_callback = "callback_on_step_end" in inspect.signature(
+            self.pipe.__call__
+        ).parameters
         self._model_loaded = True
 
+    def unload(self):
+        self.pipe = None
+        self._model_loaded = False
+
+    def _place(self, placement: str) -> str:
+        sizes = [
+            sum(t.numel() * t.element_size() for t in (*c.parameters(), *c.buffers()))
+            for c in self.pipe.components.values()
+            if isinstance(c, torch.nn.Module)
+        ]
+        if placement == "auto":
+            placement = self._auto_placement(sum(sizes), max(sizes, default=0))
+        if placement == "resident":
+            self.pipe.to(self.device)
+        elif placement == "model":
+            self.pipe.enable_model_cpu_offload(device=self.device)
+        elif placement == "sequential":
+            self.pipe.enable_sequential_cpu_offload(device=self.device)
+        else:
+            raise ValueError(f"Unknown placement {placement!r}")
+        logger.info(
+            f"Diffuser: {sum(sizes) / 2**30:.1f}GB of weights, placement={placement}"
+        )
+        return placement
+
+    def _auto_placement(self, total: int, largest: int) -> str:
+        if not self.device.startswith("cuda"):
+            return "resident"
+        if self.memory_budget_gb is not None:
+            budget = self.memory_budget_gb * 2**30
+        else:
+            budget, _ = torch.cuda.mem_get_info(torch.device(self.device))
+        if total * self.headroom <= budget:
+            return "resident"
+        if largest * self.headroom <= budget:
+            return "model"
+        return "sequential"
+
     def generate(
         self, prompt: str, image_path: str, height: int = 1024, width: int = 1024
     ):
-        self.pipe.enable_model_cpu_offload()
-        self.image = self.pipe(
-            prompt=prompt,
+        self.image = self.generate_batch([ImageRequest(prompt, height, width)])[0]
+        self.image.save(image_path)
+
+    def generate_batch(self, requests: list[ImageRequest]) -> list:
+        """
+        Images for the requests, in order: one pipeline call per resolution.
+
+        The pipeline must already be loaded, through the registry, so its
+        memory is accounted for and it can be evicted.
+        """
+        if not self._model_loaded:
+            raise RuntimeError("Diffuser.generate_batch called before load_model")
+        images = [None] * len(requests)
+        groups: dict[tuple[int, int], list[int]] = {}
+        for i, request in enumerate(requests):
+            groups.setdefault((request.height, request.width), []).append(i)
+        for (height, width), indices in groups.items():
+            for start in range(0, len(indices), self.max_batch_size):
+                chunk = indices[start : start + self.max_batch_size]
+                for i, image in zip(chunk, self._run([requests[i] for i in chunk], height, width)):
+                    images[i] = image
+        return images
+
+    def _run(self, requests: list[ImageRequest], height: int, width: int) -> list:
+        step_times = [time.perf_counter()]
+
+        def on_step_end(pipe, step, timestep, callback_kwargs):
+            step_times.append(time.perf_counter())
+            for request in requests:
+                if request.on_progress is not None:
+                    try:
+                        request.on_progress(step + 1, self.num_inference_steps)
+                    except Exception:
+                        logger.exception("Image progress callback failed")
+            return callback_kwargs
+
+        kwargs = {"callback_on_step_end": on_step_end} if self._step_callback else {}
+        images = self.pipe(
+            prompt=[r.prompt for r in requests],
             height=height,
             width=width,
-            guidance_scale=4.0,
-            num_inference_steps=4,
-            generator=torch.Generator(device=self.device).manual_seed(0),
-        ).images[0]
-        self.image.save(image_path)
+            guidance_scale=self.guidance_scale,
+            num_inference_steps=self.num_inference_steps,
+            # CPU generators: the same seed gives the same image whatever the
+            # placement or the batch it lands in
+            generator=[torch.Generator("cpu").manual_seed(r.seed) for r in requests],
+            **kwargs,
+        ).images
+        finished = time.perf_counter()
+
+        # The first interval also covers text encoding, the rest are denoising steps
+        self.last_step_ms = [(b - a) * 1000 for a, b in zip(step_times, step_times[1:])]
+        self.steps += len(self.last_step_ms)
+        self.step_ms_total += sum(self.last_step_ms)
+        self.batches += 1
+        self.images += len(requests)
+        logger.info(
+            f"Diffuser: {len(requests)} image(s) {width}x{height} in "
+            f"{(finished - step_times[0]) * 1000:.0f}ms, steps "
+            + " ".join(f"{ms:.0f}" for ms in self.last_step_ms)
+            + f"ms, decode {(finished - step_times[-1]) * 1000:.0f}ms"
+        )
+        return images
+
+    def describe(self) -> str:
+        avg_step = self.step_ms_total / self.steps if self.steps else 0.0
+        avg_batch = self.images / self.batches if self.batches else 0.0
+        return (
+            f"diffuser: placement={self.placement} batches={self.batches} "
+            f"avg_batch={avg_batch:.1f} (max={self.max_batch_size})\n"
+            f"  step avg={avg_step:.0f}ms last="
+            + "/".join(f"{ms:.0f}" for ms in self.last_step_ms)
+            + "ms"
+        )
 
 
 class Transcriber:
+    # Qwen3-ASR's feature extractor works on 16kHz audio
+    sample_rate = 16000
+    # Matches max_inference_batch_size in load_model
+    max_batch_size = 32
+
     def __init__(
         self,
         checkpoint: str = "Qwen/Qwen3-ASR-1.7B",
@@ -51,6 +217,7 @@ class Transcriber:
     ):
         self.checkpoint = checkpoint
         self.device = device
+        self.model = None
 
     def _read_wav_from_bytes(self, audio_bytes: bytes) -> tuple[np.ndarray, int]:
         """Read WAV audio data from bytes."""
@@ -58,6 +225,36 @@ class Transcriber:
             wav, sr = sf.read(f, dtype="float32", always_2d=False)
         return np.asarray(wav, dtype=np.float32), int(sr)
 
+    def decode_ogg(self, ogg_bytes: bytes) -> tuple[np.ndarray, int]:
+        """
+        Decode an in-memory OGG/Opus voice note to mono float32 PCM at the
+        model's sample rate, without writing anything to disk.
+
+        libsndfile (>= 1.0.29) decodes Opus directly; older builds fall back
+        to ffmpeg through pydub, still piping bytes in memory.
+        """
+        try:
+            with io.BytesIO(ogg_bytes) as f:
+                wav, sr = sf.read(f, dtype="float32", always_2d=True)
+        except (sf.LibsndfileError, RuntimeError):
+            segment = AudioSegment.from_file(io.BytesIO(ogg_bytes), format="ogg")
+            samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+            wav = samples.reshape(-1, segment.channels) / float(1 << (8 * segment.sample_width - 1))
+            sr = segment.frame_rate
+
+        wav = wav.mean(axis=1) if wav.shape[1] > 1 else wav[:, 0]
+        return self._resample(wav, int(sr)), self.sample_rate
+
+    def _resample(self, wav: np.ndarray, sr: int) -> np.ndarray:
+        """Resample to the model's rate (Telegram voice notes are 48kHz Opus)."""
+        if sr == self.sample_rate or len(wav) == 0:
+            return wav
+        # Band-limited FFT resampling: irfft truncates (or zero-pads) the
+        # spectrum to the new Nyquist frequency.
+        n_out = int(round(len(wav) * self.sample_rate / sr))
+        resampled = np.fft.irfft(np.fft.rfft(wav), n_out) * (n_out / len(wav))
+        return resampled.astype(np.float32)
+
     def _convert_ogg_to_wav(self, ogg_path: Path, output_dir: Path) -> Path:
         """
         Convert an .ogg file to .wav format.
@@ -87,20 +284,33 @@ class Transcriber:
             dtype=torch.bfloat16,
             device_map="cuda:0",
             attn_implementation="flash_attention_2",
-            max_inference_batch_size=32,
+            max_inference_batch_size=self.max_batch_size,
             max_new_tokens=256,
         )
 
-    def transcribe(self, data: bytes) -> Tuple[AnyStr, AnyStr]:
+    def unload(self):
+        self.model = None
+
+    def transcribe(
+        self, data: Union[bytes, Tuple[np.ndarray, int]]
+    ) -> Tuple[AnyStr, AnyStr]:
+        """Transcribe WAV bytes or already decoded (pcm, sample_rate) audio."""
+        return self.transcribe_batch([data])[0]
+
+    def transcribe_batch(
+        self, clips: list[Union[bytes, Tuple[np.ndarray, int]]]
+    ) -> list[Tuple[AnyStr, AnyStr]]:
+        """Transcribe several clips in one model call, returning (language, text) per clip."""
+        audio = [
+            self._read_wav_from_bytes(data) if isinstance(data, bytes) else data
+            for data in clips
+        ]
         results = self.model.transcribe(
-            audio=self._read_wav_from_bytes(data),
+            audio=audio,
             language=None,
         )
 
-        transcribed_lang = results[0].language
-        transcribed_text = results[0].text
-
-        return transcribed_lang, transcribed_text
+        return [(result.language, result.text) for result in results]
 
 
 class Chat:
@@ -112,6 +322,10 @@ class Chat:
         quantization: bool = False,
         device: str = "auto",
         system_msg: str = "You are a chat bot that responds using markdown syntax",
+        kv_cache_mb: int = 1024,
+        max_history_tokens: int = 4096,
+        summarize_history: bool = False,
+        summary_max_tokens: int = 256,
     ):
         self.checkpoint = checkpoint
         self.stream = stream
@@ -119,7 +333,15 @@ class Chat:
         self.quantization = quantization
         self.device = device
         self.system_msg = system_msg
-        self.messages = [{"role": "system", "content": self.system_msg}]
+        self.max_history_tokens = max_history_tokens
+        self.summarize_history = summarize_history
+        self.summary_max_tokens = summary_max_tokens
+        self.model = None
+        self.history = None
+        self.scheduler = None
+        self.sessions = {}
+        # Past key/values per conversation, so a turn only prefills its new tokens
+        self.kv_cache = ConversationCache(kv_cache_mb * 2**20)
 
     def load_model(self):
         if self.quantization and self.device != "mps":
@@ -135,17 +357,54 @@ class Chat:
         self.tokenizer = AutoTokenizer.from_pretrained(
             self.checkpoint, skip_special_tokens=True
         )
+        if self.history is None:
+            self.history = self.new_history(
+                summarize=self._summarize if self.summarize_history else None
+            )
+
+    def unload(self):
+        """Free the model; conversations and the tokenizer are kept for the next load."""
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
+        self.kv_cache.clear()
+        self.model = None
+
+    def new_history(self, summarize=None) -> ChatHistory:
+        return ChatHistory(
+            self.system_msg,
+            token_counter(self.tokenizer),
+            max_tokens=self.max_history_tokens,
+            summarize=summarize,
+        )
 
     def clear(self):
-        self.messages = [{"role": "system", "content": self.system_msg}]
+        self.history.clear()
+        self.kv_cache.drop(DEFAULT_CONVERSATION)
+
+    def _summarize(self, summary, dropped) -> str:
+        inputs = self.tokenizer.apply_chat_template(
+            summary_prompt(summary, dropped),
+            return_dict=True,
+            tokenize=True,
+            return_tensors="pt",
+            add_generation_prompt=True,
+        ).to(self.model.device)
+        outputs = self.model.generate(
+            **inputs, max_new_tokens=self.summary_max_tokens, use_cache=True
+        )
+        return self.tokenizer.decode(
+            outputs[0][inputs["input_ids"].shape[-1] :], skip_special_tokens=True
+        )
 
     def generate(self, message: str):
         user_msg = message
 
-        self.messages.append({"role": "user", "content": user_msg})
+        self.history.append("user", user_msg)
+        self.history.fit()
 
         inputs = self.tokenizer.apply_chat_template(
-            self.messages,
+            self.history.messages,
             return_dict=True,
             tokenize=True,
             return_tensors="pt",
@@ -153,15 +412,152 @@ class Chat:
         ).to(self.model.device)
 
         inputs_len = inputs["input_ids"].shape[-1]
+        past_key_values, _ = self.kv_cache.take(
+            DEFAULT_CONVERSATION, inputs["input_ids"][0].tolist()
+        )
 
         generation_config = inputs
         generation_config["max_new_tokens"] = self.max_new_tokens
         generation_config["use_cache"] = True
+        generation_config["past_key_values"] = past_key_values
+        generation_config["return_dict_in_generate"] = True
 
         outputs = self.model.generate(**generation_config)
+        # The cache covers every token but the last generated one
+        self.kv_cache.put(
+            DEFAULT_CONVERSATION,
+            outputs.sequences[0][:-1].tolist(),
+            outputs.past_key_values,
+        )
         decoded_outputs = self.tokenizer.decode(
-            outputs[0][inputs_len:], skip_special_tokens=True
+            outputs.sequences[0][inputs_len:], skip_special_tokens=True
         )
-        self.messages.append({"role": "system", "content": decoded_outputs})
+        self.history.append("assistant", decoded_outputs)
 
         return decoded_outputs
+
+    def start_scheduler(self, max_batch_size: int = 8):
+        """Serve sessions through a continuous-batching scheduler (after load_model)."""
+        self.scheduler = ChatScheduler(
+            self.model, self.tokenizer, max_batch_size=max_batch_size
+        )
+
+    def session(self, conversation_id) -> "ChatSession":
+        """The conversation with the given id, created on first use."""
+        if conversation_id not in self.sessions:
+            self.sessions[conversation_id] = ChatSession(self, conversation_id)
+        return self.sessions[conversation_id]
+
+
+class ChatSession:
+    """One conversation's history, generating through the shared scheduler."""
+
+    def __init__(self, chat: Chat, conversation_id):
+        self.chat = chat
+        self.conversation_id = conversation_id
+        # Summaries go through the scheduler, so fit() only drops turns here
+        self.history = chat.new_history()
+        # One turn at a time per conversation, other conversations batch alongside.
+        self._lock = asyncio.Lock()
+        # Bumped by clear(), so a turn in flight doesn't write into the new conversation
+        self._generation = 0
+
+    def clear(self):
+        self._generation += 1
+        self.history.clear()
+        self.chat.kv_cache.drop(self.conversation_id)
+
+    async def _tokenize(self, messages: list[dict]):
+        inputs = await asyncio.to_thread(
+            self.chat.tokenizer.apply_chat_template,
+            messages,
+            return_dict=True,
+            tokenize=True,
+            return_tensors="pt",
+            add_generation_prompt=True,
+        )
+        return inputs["input_ids"]
+
+    async def _summarize(self, dropped: list[dict], started_in: int):
+        input_ids = await self._tokenize(summary_prompt(self.history.summary, dropped))
+        output_ids = await self.chat.scheduler.generate(
+            input_ids, self.chat.summary_max_tokens
+        )
+        if self._generation != started_in:
+            return
+        self.history.set_summary(
+            self.chat.tokenizer.decode(output_ids, skip_special_tokens=True)
+        )
+
+    async def generate(self, message: str) -> str:
+        text = ""
+        async for text in self.stream(message):
+            pass
+        return text
+
+    async def stream(self, message: str) -> AsyncIterator[str]:
+        """
+        Answer message, yielding the reply decoded so far as tokens arrive.
+
+        Tokens come from the scheduler thread; text is only decoded when the
+        consumer asks for the next chunk, so a slow consumer (a rate-limited
+        Telegram edit) sees fewer, larger chunks.
+        """
+        async with self._lock:
+            started_in = self._generation
+            self.history.append("user", message)
+            dropped = self.history.fit()
+            if dropped and self.chat.summarize_history:
+                await self._summarize(dropped, started_in)
+            input_ids = await self._tokenize(self.history.messages)
+            past_key_values, past_length = self.chat.kv_cache.take(
+                self.conversation_id, input_ids[0].tolist()
+            )
+
+            loop = asyncio.get_running_loop()
+            new_tokens = asyncio.Event()
+            latest = [[]]
+
+            def on_token(output_ids):
+                # Runs on the scheduler thread
+                latest[0] = list(output_ids)
+                loop.call_soon_threadsafe(new_tokens.set)
+
+            generation = asyncio.ensure_future(
+                self.chat.scheduler.generate_cached(
+                    input_ids,
+                    self.chat.max_new_tokens,
+                    past_key_values,
+                    past_length,
+                    on_token=on_token,
+                )
+            )
+            try:
+                while not generation.done():
+                    waiter = asyncio.ensure_future(new_tokens.wait())
+                    await asyncio.wait(
+                        [generation, waiter], return_when=asyncio.FIRST_COMPLETED
+                    )
+                    waiter.cancel()
+                    if new_tokens.is_set():
+                        new_tokens.clear()
+                        yield self.chat.tokenizer.decode(
+                            latest[0], skip_special_tokens=True
+                        )
+                output_ids, past_key_values = generation.result()
+            finally:
+                generation.cancel()
+
+            decoded_outputs = self.chat.tokenizer.decode(
+                output_ids, skip_special_tokens=True
+            )
+            # Cleared mid-turn: the reply still goes out, but the new
+            # conversation starts empty and with no cache.
+            if self._generation == started_in:
+                self.chat.kv_cache.put(
+                    self.conversation_id,
+                    input_ids[0].tolist() + output_ids[:-1],
+                    past_key_values,
+                )
+                self.history.append("assistant", decoded_outputs)
+            yield decoded_outputs
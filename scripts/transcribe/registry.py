@@ -0,0 +1,173 @@
+"""
+On-demand model loading with idle eviction.
+
+Models are registered with a load and an unload function and loaded the first
+time a handler uses one, instead of all at startup. Handlers wrap every use in
+`async with registry.use(name)`, which loads the model if needed and keeps it
+from being evicted until the block exits.
+
+Loads run one at a time on a worker thread: concurrent first requests for a
+model wait for the same load, and the GPU memory a load adds can be measured.
+Models that are not in use are evicted least recently used first when a load
+would go over the memory budget, and after idle_evict_s without use.
+"""
+
+import asyncio
+import gc
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ManagedModel:
+    name: str
+    load: Callable[[], None]
+    unload: Callable[[], None]
+    loaded: bool = False
+    in_use: int = 0
+    last_used: float = 0.0
+    # Measured on the last load, 0 until the model has been loaded once
+    nbytes: int = 0
+    loads: int = 0
+    evictions: int = 0
+
+
+def gpu_allocated() -> int:
+    return torch.cuda.memory_allocated() if torch.cuda.is_available() else 0
+
+
+class ModelRegistry:
+    def __init__(
+        self,
+        memory_budget_gb: float | None = None,
+        idle_evict_s: float | None = None,
+    ):
+        self.memory_budget = memory_budget_gb * 2**30 if memory_budget_gb else None
+        self.idle_evict_s = idle_evict_s
+        self.models: dict[str, ManagedModel] = {}
+        self._load_lock = asyncio.Lock()
+        self._sweeper: asyncio.Task | None = None
+
+    def register(self, name: str, load: Callable[[], None], unload: Callable[[], None]):
+        self.models[name] = ManagedModel(name, load, unload)
+
+    @property
+    def loaded_bytes(self) -> int:
+        return sum(m.nbytes for m in self.models.values() if m.loaded)
+
+    @asynccontextmanager
+    async def use(self, name: str) -> AsyncIterator[None]:
+        """Hold the model loaded for the duration of the block."""
+        model = self.models[name]
+        model.in_use += 1
+        try:
+            if not model.loaded:
+                await self._load(model)
+            model.last_used = time.monotonic()
+            yield
+        finally:
+            model.in_use -= 1
+            model.last_used = time.monotonic()
+
+    async def preload(self, *names: str):
+        for name in names:
+            async with self.use(name):
+                pass
+
+    def start(self):
+        """Start evicting idle models (needs a running event loop)."""
+        if self.idle_evict_s:
+            self._sweeper = asyncio.create_task(self._evict_idle_periodically())
+
+    def describe(self) -> str:
+        now = time.monotonic()
+        lines = [
+            f"models: {self.loaded_bytes / 2**30:.1f}GB loaded"
+            + (f" of {self.memory_budget / 2**30:.1f}GB" if self.memory_budget else "")
+        ]
+        for m in self.models.values():
+            state = f"loaded, idle {now - m.last_used:.0f}s" if m.loaded else "unloaded"
+            if m.in_use:
+                state = f"in use by {m.in_use}"
+            lines.append(
+                f"  {m.name}: {state} ({m.nbytes / 2**30:.1f}GB) "
+                f"loads={m.loads} evictions={m.evictions}"
+            )
+        return "\n".join(lines)
+
+    async def _load(self, model: ManagedModel):
+        async with self._load_lock:
+            if model.loaded:
+                # Someone else's request loaded it while we waited.
+                return
+            await self._make_room(model.nbytes, keep=model)
+            started = time.perf_counter()
+            before = gpu_allocated()
+            await asyncio.to_thread(model.load)
+            model.nbytes = max(gpu_allocated() - before, 0) or model.nbytes
+            model.loaded = True
+            model.loads += 1
+            logger.info(
+                f"Loaded {model.name} in {time.perf_counter() - started:.1f}s "
+                f"({model.nbytes / 2**30:.1f}GB)"
+            )
+            # The first load of a model only reveals its size afterwards.
+            await self._make_room(0, keep=model)
+
+    async def _make_room(self, needed: int, keep: ManagedModel):
+        if self.memory_budget is None:
+            return
+        idle = sorted(
+            (m for m in self.models.values() if m.loaded and not m.in_use and m is not keep),
+            key=lambda m: m.last_used,
+        )
+        for model in idle:
+            if self.loaded_bytes + needed <= self.memory_budget:
+                break
+            # Checked again: a handler may have picked it up during an await.
+            if model.loaded and not model.in_use:
+                await self._evict(model, "over memory budget")
+        if self.loaded_bytes + needed > self.memory_budget:
+            logger.warning(
+                f"Models in use need {(self.loaded_bytes + needed) / 2**30:.1f}GB, "
+                f"over the {self.memory_budget / 2**30:.1f}GB budget"
+            )
+
+    async def _evict(self, model: ManagedModel, reason: str):
+        """Unload a model; only call with the load lock held and the model not in use."""
+        started = time.perf_counter()
+        idle_s = time.monotonic() - model.last_used
+        model.loaded = False
+        await asyncio.to_thread(_unload, model.unload)
+        model.evictions += 1
+        logger.info(
+            f"Evicted {model.name} ({reason}, idle {idle_s:.0f}s) in "
+            f"{time.perf_counter() - started:.1f}s, freed {model.nbytes / 2**30:.1f}GB"
+        )
+
+    async def _evict_idle_periodically(self):
+        while True:
+            await asyncio.sleep(min(self.idle_evict_s / 4, 60))
+            now = time.monotonic()
+            async with self._load_lock:
+                for model in self.models.values():
+                    if (
+                        model.loaded
+                        and not model.in_use
+                        and now - model.last_used >= self.idle_evict_s
+                    ):
+                        await self._evict(model, "idle")
+
+
+def _unload(unload: Callable[[], None]):
+    unload()
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
@@ -0,0 +1,389 @@
+"""
+Iteration-level (continuous batching) scheduler for the chat model.
+
+Every active conversation turn is a sequence. The scheduler thread admits
+waiting sequences by prefilling them one at a time, then runs one decode step
+for all running sequences in a single batched forward pass. Finished sequences
+leave the batch after the step that produced their last token and new ones join
+before the next step, so one resident model serves many users at once.
+
+Running sequences share a left-padded key/value cache; an attention mask hides
+the padding and explicit position ids keep every sequence's positions intact.
+A sequence can start from a previous turn's cache, so only its new tokens are
+prefilled, and can ask for its own cache back when it finishes.
+Models whose cache isn't a plain per-layer key/value cache (hybrid conv or
+linear-attention models) still work: their sequences are stepped one by one,
+interleaved at token granularity.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+import torch
+from transformers import DynamicCache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Sequence:
+    """One generation request flowing through the scheduler."""
+
+    input_ids: torch.Tensor
+    max_new_tokens: int
+    future: asyncio.Future
+    loop: asyncio.AbstractEventLoop
+    on_token: Callable[[list[int]], None] | None = None
+    output_ids: list[int] = field(default_factory=list)
+    position: int = 0
+    # Cache covering the first past_length tokens of input_ids on admission,
+    # the sequence's own cache while it runs unbatched, and its final cache
+    # when keep_cache is set.
+    past_key_values: object = None
+    past_length: int = 0
+    keep_cache: bool = False
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+def cache_to_tensors(cache) -> list[tuple[torch.Tensor, torch.Tensor]] | None:
+    """Per-layer (keys, values) of a standard attention cache, None for other cache types."""
+    if isinstance(cache, tuple):
+        return list(cache)
+    if type(cache) is not DynamicCache:
+        return None
+    if hasattr(cache, "layers"):
+        # Sliding-window or linear-attention layers can't be padded and merged.
+        if any(type(layer).__name__ != "DynamicLayer" for layer in cache.layers):
+            return None
+        layers = [(layer.keys, layer.values) for layer in cache.layers]
+    else:
+        layers = list(zip(cache.key_cache, cache.value_cache))
+    if any(k is None or k.dim() != 4 for k, _ in layers):
+        return None
+    return layers
+
+
+def tensors_to_cache(layers: list[tuple[torch.Tensor, torch.Tensor]]) -> DynamicCache:
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+def left_pad(tensor: torch.Tensor, length: int, dim: int) -> torch.Tensor:
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+
+class ChatScheduler:
+    """Continuous-batching decode loop running on a dedicated thread."""
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        max_batch_size: int = 8,
+        temperature: float = 0.0,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.temperature = temperature
+        eos = model.generation_config.eos_token_id
+        if eos is None:
+            eos = tokenizer.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+
+        self.batchable: bool | None = None
+        self._waiting: queue.Queue[Sequence | None] = queue.Queue()
+        self._running: list[Sequence] = []
+        # Shared cache of the running batch, updated in place by each decode
+        # step and only rebuilt when sequences join or leave.
+        self._cache: DynamicCache | None = None
+        self._mask: torch.Tensor | None = None
+
+        self.steps = 0
+        self.step_rows_total = 0
+        self.tokens_total = 0
+        self.decode_s_total = 0.0
+        self.prefill_tokens_total = 0
+        self.prefill_s_total = 0.0
+        self._thread = threading.Thread(target=self._loop, name="chat-scheduler", daemon=True)
+        self._thread.start()
+
+    async def generate(
+        self,
+        input_ids: torch.Tensor,
+        max_new_tokens: int,
+        on_token: Callable[[list[int]], None] | None = None,
+    ) -> list[int]:
+        """Queue a tokenized prompt (shape [1, n]) and await its generated token ids."""
+        seq = await self._submit(input_ids, max_new_tokens, on_token)
+        return seq.output_ids
+
+    async def generate_cached(
+        self,
+        input_ids: torch.Tensor,
+        max_new_tokens: int,
+        past_key_values=None,
+        past_length: int = 0,
+        on_token: Callable[[list[int]], None] | None = None,
+    ) -> tuple[list[int], object]:
+        """
+        Like generate(), starting from past_key_values for the first past_length
+        prompt tokens. Also returns the final cache, which covers the prompt
+        and every generated token but the last one.
+        """
+        seq = await self._submit(
+            input_ids, max_new_tokens, on_token, past_key_values, past_length, keep_cache=True
+        )
+        return seq.output_ids, seq.past_key_values
+
+    async def _submit(
+        self,
+        input_ids: torch.Tensor,
+        max_new_tokens: int,
+        on_token: Callable[[list[int]], None] | None,
+        past_key_values=None,
+        past_length: int = 0,
+        keep_cache: bool = False,
+    ) -> Sequence:
+        loop = asyncio.get_running_loop()
+        seq = Sequence(
+            input_ids.to(self.model.device),
+            max_new_tokens,
+            loop.create_future(),
+            loop,
+            on_token,
+            past_key_values=past_key_values,
+            past_length=past_length if past_key_values is not None else 0,
+            keep_cache=keep_cache,
+        )
+        self._waiting.put(seq)
+        return await seq.future
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting.qsize()
+
+    def describe(self) -> str:
+        avg_batch = self.step_rows_total / self.steps if self.steps else 0.0
+        tokens_per_s = self.tokens_total / self.decode_s_total if self.decode_s_total else 0.0
+        prefill_per_s = self.prefill_tokens_total / self.prefill_s_total if self.prefill_s_total else 0.0
+        return (
+            f"chat: waiting={self.queue_depth} running={len(self._running)} "
+            f"batched={self.batchable}\n"
+            f"  steps={self.steps} avg_batch={avg_batch:.1f} (max={self.max_batch_size})"
+            f" tokens/s={tokens_per_s:.1f}\n"
+            f"  prefilled={self.prefill_tokens_total} tokens ({prefill_per_s:.0f}/s)"
+        )
+
+    def stop(self):
+        """Finish the running sequences, then end the scheduler thread."""
+        self._waiting.put(None)
+        self._thread.join()
+
+    def _loop(self):
+        while True:
+            if not self._running:
+                # Idle: block until there's work.
+                seq = self._waiting.get()
+                if seq is None:
+                    return
+                self._admit(seq)
+            while len(self._running) < self.max_batch_size:
+                try:
+                    seq = self._waiting.get_nowait()
+                except queue.Empty:
+                    break
+                if seq is None:
+                    # Stop once the running sequences are done.
+                    self._waiting.put(None)
+                    break
+                self._admit(seq)
+            if self._running:
+                try:
+                    self._step()
+                except BaseException as e:
+                    logger.exception("Decode step failed")
+                    for seq in self._running:
+                        seq.loop.call_soon_threadsafe(_fail, seq.future, e)
+                    self._running, self._cache, self._mask = [], None, None
+
+    def _sample(self, logits: torch.Tensor) -> torch.Tensor:
+        """Next token per row of [batch, vocab] logits."""
+        if self.temperature <= 0:
+            return logits.argmax(dim=-1)
+        probs = torch.softmax(logits.float() / self.temperature, dim=-1)
+        return torch.multinomial(probs, 1).squeeze(-1)
+
+    def _emit(self, seq: Sequence, token: int) -> bool:
+        """Record a generated token, return True when the sequence is finished."""
+        seq.output_ids.append(token)
+        if seq.on_token is not None:
+            seq.on_token(seq.output_ids)
+        return token in self.eos_token_ids or len(seq.output_ids) >= seq.max_new_tokens
+
+    def _finish(self, seq: Sequence, cache_fn: Callable[[], object]):
+        """Resolve a finished sequence, with its own cache if it asked for it."""
+        seq.past_key_values = cache_fn() if seq.keep_cache else None
+        logger.debug(
+            f"Sequence done: {len(seq.output_ids)} tokens in "
+            f"{time.perf_counter() - seq.enqueued_at:.2f}s"
+        )
+        seq.loop.call_soon_threadsafe(_resolve, seq.future, seq)
+
+    def _admit(self, seq: Sequence):
+        if seq.future.cancelled():
+            return
+        try:
+            self._prefill(seq)
+        except BaseException as e:
+            logger.exception("Prefill failed")
+            seq.loop.call_soon_threadsafe(_fail, seq.future, e)
+
+    @torch.inference_mode()
+    def _prefill(self, seq: Sequence):
+        """Prefill a waiting sequence and add it to the running batch."""
+        started = time.perf_counter()
+        out = self.model(
+            input_ids=seq.input_ids[:, seq.past_length:],
+            past_key_values=seq.past_key_values,
+            use_cache=True,
+        )
+        seq.position = seq.input_ids.shape[-1]
+        self.prefill_tokens_total += seq.position - seq.past_length
+        self.prefill_s_total += time.perf_counter() - started
+        token = int(self._sample(out.logits[:, -1])[0])
+        if self._emit(seq, token):
+            self._finish(seq, lambda: out.past_key_values)
+            return
+
+        layers = cache_to_tensors(out.past_key_values)
+        if self.batchable is None:
+            self.batchable = layers is not None
+            logger.info(f"Chat scheduler: batched decoding {'on' if self.batchable else 'off'}")
+        seq.past_key_values = out.past_key_values
+        if not self.batchable:
+            self._running.append(seq)
+            return
+        # From here on the sequence lives in the shared cache.
+        seq.past_key_values = None
+
+        mask = torch.ones(1, seq.position, dtype=torch.long, device=seq.input_ids.device)
+        if not self._running:
+            self._cache, self._mask = out.past_key_values, mask
+        else:
+            length = max(self._mask.shape[1], seq.position)
+            self._cache = tensors_to_cache([
+                (
+                    torch.cat([left_pad(k, length, 2), left_pad(nk, length, 2)], dim=0),
+                    torch.cat([left_pad(v, length, 2), left_pad(nv, length, 2)], dim=0),
+                )
+                for (k, v), (nk, nv) in zip(cache_to_tensors(self._cache), layers)
+            ])
+            self._mask = torch.cat([left_pad(self._mask, length, 1), left_pad(mask, length, 1)], dim=0)
+        self._running.append(seq)
+
+    @torch.inference_mode()
+    def _step(self):
+        """One decode step for every running sequence."""
+        started = time.perf_counter()
+        rows = len(self._running)
+        if self.batchable:
+            finished = self._step_batched()
+        else:
+            finished = self._step_each()
+        self.steps += 1
+        self.step_rows_total += rows
+        self.tokens_total += rows
+        self.decode_s_total += time.perf_counter() - started
+
+        keep = [i for i in range(rows) if i not in finished]
+        if len(keep) == rows:
+            return
+        self._running = [self._running[i] for i in keep]
+        if not self.batchable:
+            return
+        if not keep:
+            self._cache, self._mask = None, None
+            return
+        index = torch.tensor(keep, device=self._mask.device)
+        mask = self._mask.index_select(0, index)
+        # Drop leading columns that are padding for every remaining row.
+        first = int(mask.any(dim=0).nonzero()[0])
+        self._mask = mask[:, first:]
+        self._cache = tensors_to_cache([
+            (k.index_select(0, index)[:, :, first:], v.index_select(0, index)[:, :, first:])
+            for k, v in cache_to_tensors(self._cache)
+        ])
+
+    def _step_batched(self) -> set[int]:
+        device = self._mask.device
+        input_ids = torch.tensor([[seq.output_ids[-1]] for seq in self._running], device=device)
+        position_ids = torch.tensor([[seq.position] for seq in self._running], device=device)
+        self._mask = torch.cat([self._mask, self._mask.new_ones(len(self._running), 1)], dim=1)
+        out = self.model(
+            input_ids=input_ids,
+            attention_mask=self._mask,
+            position_ids=position_ids,
+            past_key_values=self._cache,
+            use_cache=True,
+        )
+        self._cache = out.past_key_values
+        tokens = self._sample(out.logits[:, -1]).tolist()
+        finished = set()
+        for i, (seq, token) in enumerate(zip(self._running, tokens)):
+            seq.position += 1
+            if seq.future.cancelled():
+                finished.add(i)
+            elif self._emit(seq, token):
+                self._finish(seq, lambda: self._row_cache(i, seq.position))
+                finished.add(i)
+        return finished
+
+    def _row_cache(self, row: int, length: int) -> DynamicCache:
+        """Copy of one row of the shared cache, without its padding."""
+        return tensors_to_cache([
+            (k[row : row + 1, :, -length:].clone(), v[row : row + 1, :, -length:].clone())
+            for k, v in cache_to_tensors(self._cache)
+        ])
+
+    def _step_each(self) -> set[int]:
+        finished = set()
+        for i, seq in enumerate(self._running):
+            device = seq.input_ids.device
+            out = self.model(
+                input_ids=torch.tensor([[seq.output_ids[-1]]], device=device),
+                position_ids=torch.tensor([[seq.position]], device=device),
+                past_key_values=seq.past_key_values,
+                use_cache=True,
+            )
+            seq.past_key_values = out.past_key_values
+            seq.position += 1
+            token = int(self._sample(out.logits[:, -1])[0])
+            if seq.future.cancelled():
+                finished.add(i)
+            elif self._emit(seq, token):
+                self._finish(seq, lambda: seq.past_key_values)
+                finished.add(i)
+        return finished
+
+
+def _resolve(future: asyncio.Future, seq: Sequence):
+    if not future.done():
+        future.set_result(seq)
+
+
+def _fail(future: asyncio.Future, exc: BaseException):
+    if not future.done():
+        future.set_exception(exc)
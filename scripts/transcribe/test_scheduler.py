@@ -0,0 +1,102 @@
+"""
+Tests for ChatScheduler on CPU, with a tiny randomly initialized model.
+Run with: python -m pytest test_scheduler.py
+"""
+
+import asyncio
+import types
+
+import pytest
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from scheduler import ChatScheduler
+
+MAX_NEW_TOKENS = 12
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=128,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=256,
+        eos_token_id=1,
+        pad_token_id=0,
+        # Sharper than the default init, so small errors change the argmax
+        initializer_range=0.2,
+    )
+    config._attn_implementation = "eager"
+    return LlamaForCausalLM(config).eval()
+
+
+@pytest.fixture
+def scheduler(model):
+    # The scheduler only reads eos_token_id from the tokenizer
+    scheduler = ChatScheduler(model, types.SimpleNamespace(eos_token_id=1), max_batch_size=4)
+    yield scheduler
+    scheduler.stop()
+
+
+def prompt(length, seed):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randint(2, 128, (1, length), generator=generator)
+
+
+def reference(model, input_ids, max_new_tokens=MAX_NEW_TOKENS):
+    """Greedy tokens from model.generate, one sequence at a time."""
+    output = model.generate(
+        input_ids,
+        attention_mask=torch.ones_like(input_ids),
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+    )
+    return output[0, input_ids.shape[-1]:].tolist()
+
+
+def test_batched_greedy_matches_generate(model, scheduler):
+    # Different lengths, so the shared cache is left-padded on every join
+    prompts = [prompt(length, seed) for seed, length in enumerate([5, 17, 9, 30, 3, 12])]
+
+    async def main():
+        tasks = []
+        for input_ids in prompts:
+            tasks.append(asyncio.ensure_future(scheduler.generate(input_ids, MAX_NEW_TOKENS)))
+            # Later prompts join a batch that is already decoding
+            await asyncio.sleep(0.01)
+        return await asyncio.gather(*tasks)
+
+    outputs = asyncio.run(main())
+    assert scheduler.batchable
+    assert scheduler.step_rows_total > scheduler.steps  # some steps were batched
+    for input_ids, output_ids in zip(prompts, outputs):
+        assert output_ids == reference(model, input_ids)
+
+
+def test_cached_turn_matches_generate(model, scheduler):
+    first = prompt(10, 100)
+    follow_up = prompt(6, 101)
+
+    async def main():
+        # A longer prompt decoding alongside pads the first turn's row, whose
+        # cache then has to come back without the padding
+        other = asyncio.ensure_future(scheduler.generate(prompt(30, 102), 2 * MAX_NEW_TOKENS))
+        await asyncio.sleep(0.01)
+        output_ids, cache = await scheduler.generate_cached(first, MAX_NEW_TOKENS)
+        # The cache covers the prompt and every generated token but the last
+        history = torch.cat([first, torch.tensor([output_ids])], dim=1)
+        input_ids = torch.cat([history, follow_up], dim=1)
+        cached, _ = await scheduler.generate_cached(
+            input_ids, MAX_NEW_TOKENS, cache, history.shape[-1] - 1
+        )
+        await other
+        return output_ids, input_ids, cached
+
+    output_ids, input_ids, cached = asyncio.run(main())
+    assert output_ids == reference(model, first)
+    assert cached == reference(model, input_ids)
@@ -0,0 +1,243 @@
+"""
+Person detection actions for detect_objects.py, off the frame loop.
+
+The frame loop only calls ActionDispatcher.dispatch, which decides whether the
+person's action fires and queues the work; nothing in it touches disk or the
+network. A person (track) fires at most once every cooldown_s seconds, instead
+of on every frame they are in view.
+
+When an action fires:
+- the person callback (execute_action_on_person_detected) and the crop
+  writes (cv2.imwrite) run on a small worker pool,
+- webhook events and log lines go to one delivery thread, which POSTs the
+  events in batches (a JSON list per request) through a pooled HTTP session
+  and appends the log lines in one write, every flush_interval_s or when
+  max_batch_size events are waiting.
+
+Work is bounded: when max_pending jobs are already queued, new ones are
+dropped and counted rather than stalling the frame loop.
+"""
+
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class ActionDispatcher:
+    """
+    Debounced, asynchronous actions for detected people.
+
+    Args:
+        on_person (callable): Called as on_person(frame, detection_info,
+            person_id, frame_timestamp) on a worker thread when a person fires
+        cooldown_s (float): Minimum seconds between two firings of one person
+        workers (int): Threads running callbacks and writing crops
+        crop_dir (str): Save person crops here (None to skip)
+        webhook_url (str): POST batches of events here (None to skip)
+        log_path (str): Append a line per event to this file (None to skip)
+        max_batch_size (int): Deliver as soon as this many events are waiting
+        flush_interval_s (float): Deliver waiting events at least this often
+        max_pending (int): Jobs queued on the worker pool before new ones are dropped
+        timeout_s (float): Webhook request timeout
+    """
+
+    def __init__(self, on_person=None, cooldown_s=5.0, workers=2, crop_dir=None,
+                 webhook_url=None, log_path=None, max_batch_size=64,
+                 flush_interval_s=1.0, max_pending=256, timeout_s=5.0):
+        self.on_person = on_person
+        self.cooldown_s = cooldown_s
+        self.crop_dir = Path(crop_dir) if crop_dir else None
+        self.webhook_url = webhook_url
+        self.log_path = Path(log_path) if log_path else None
+        self.max_batch_size = max_batch_size
+        self.flush_interval_s = flush_interval_s
+        self.max_pending = max_pending
+        self.timeout_s = timeout_s
+        if self.crop_dir is not None:
+            self.crop_dir.mkdir(parents=True, exist_ok=True)
+
+        # (source, person_id) -> monotonic time it last fired
+        self._last_fired = {}
+        self._last_prune = time.monotonic()
+
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="action")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        self._events = queue.Queue(maxsize=max_pending)
+        self._session = requests.Session()
+        # Keep-alive connections, reused by every batch
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self._closing = threading.Event()
+        self._delivery = threading.Thread(target=self._deliver_loop, name="action-delivery",
+                                          daemon=True)
+        self._delivery.start()
+
+        self.fired = 0
+        self.suppressed = 0
+        self.dropped = 0
+        self.crops_written = 0
+        self.callback_errors = 0
+        self.events_sent = 0
+        self.batches_sent = 0
+        self.batches_failed = 0
+        self.lines_logged = 0
+        self.log_errors = 0
+
+    def dispatch(self, frame, detection_info, person_id, frame_timestamp, source=None):
+        """
+        Fire the person's action unless it fired less than cooldown_s ago.
+
+        Only queues work, so it is safe to call from the frame loop; the frame
+        may be drawn on afterwards, fired actions get their own copy.
+
+        Returns:
+            bool: Whether the action fired
+        """
+        now = time.monotonic()
+        key = (source, person_id)
+        last = self._last_fired.get(key)
+        if last is not None and now - last < self.cooldown_s:
+            self.suppressed += 1
+            return False
+        self._last_fired[key] = now
+        self._prune(now)
+        self.fired += 1
+
+        event = {
+            'source': source,
+            'person_id': person_id,
+            'bbox': detection_info['bbox'],
+            'confidence': float(detection_info['confidence']),
+            'timestamp': frame_timestamp,
+        }
+        if self.on_person is not None:
+            self._submit(self._run_callback, frame.copy(), detection_info, person_id,
+                         frame_timestamp)
+        if self.crop_dir is not None:
+            x1, y1, x2, y2 = (max(int(v), 0) for v in detection_info['bbox'])
+            crop = frame[y1:y2, x1:x2].copy()
+            prefix = "person_detected" if source is None else f"person_detected_{source}"
+            name = f"{prefix}_{person_id}_{frame_timestamp * 1000:.0f}.jpg"
+            self._submit(self._write_crop, self.crop_dir / name, crop)
+        if self.webhook_url is not None or self.log_path is not None:
+            try:
+                self._events.put_nowait(event)
+            except queue.Full:
+                self.dropped += 1
+        return True
+
+    def close(self):
+        """Finish queued work and deliver the remaining events."""
+        self._pool.shutdown(wait=True)
+        self._closing.set()
+        self._delivery.join()
+        self._session.close()
+
+    def describe(self):
+        return (
+            f"actions: fired {self.fired} suppressed {self.suppressed} dropped {self.dropped} | "
+            f"pending {self._pending} crops {self.crops_written} "
+            f"callback errors {self.callback_errors} | webhook {self.events_sent} events in "
+            f"{self.batches_sent} batches ({self.batches_failed} failed) | "
+            f"logged {self.lines_logged} ({self.log_errors} failed writes)"
+        )
+
+    def _prune(self, now):
+        """Forget people who can fire again anyway, so the table stays small."""
+        if now - self._last_prune < self.cooldown_s:
+            return
+        self._last_prune = now
+        self._last_fired = {
+            key: fired for key, fired in self._last_fired.items()
+            if now - fired < self.cooldown_s
+        }
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending += 1
+        self._pool.submit(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        try:
+            fn(*args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    # Everything below runs on the worker pool or the delivery thread.
+
+    def _run_callback(self, frame, detection_info, person_id, frame_timestamp):
+        try:
+            self.on_person(frame, detection_info, person_id, frame_timestamp)
+        except Exception as e:
+            with self._lock:
+                self.callback_errors += 1
+            print(f"Person action failed: {e}")
+
+    def _write_crop(self, path, crop):
+        if crop.size and cv2.imwrite(str(path), crop):
+            with self._lock:
+                self.crops_written += 1
+
+    def _deliver_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._deliver(batch)
+            elif self._closing.is_set() and self._events.empty():
+                return
+
+    def _next_batch(self):
+        """Events waiting after up to flush_interval_s, at most max_batch_size of them."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval_s
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or (self._closing.is_set() and self._events.empty()):
+                break
+            try:
+                batch.append(self._events.get(timeout=min(timeout, 0.1)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _deliver(self, batch):
+        if self.log_path is not None:
+            try:
+                with open(self.log_path, 'a') as f:
+                    f.writelines(
+                        f"{e['timestamp']:.0f} - Person {e['person_id']} detected at "
+                        f"({e['bbox'][0]:.0f},{e['bbox'][1]:.0f})"
+                        + ("" if e['source'] is None else f" on camera {e['source']}") + "\n"
+                        for e in batch
+                    )
+                self.lines_logged += len(batch)
+            except OSError as e:
+                self.log_errors += 1
+                print(f"Logging {len(batch)} events to {self.log_path} failed: {e}")
+        if self.webhook_url is not None:
+            try:
+                response = self._session.post(
+                    self.webhook_url,
+                    data=json.dumps(batch),
+                    headers={'Content-Type': 'application/json'},
+                    timeout=self.timeout_s,
+                )
+                response.raise_for_status()
+                self.batches_sent += 1
+                self.events_sent += len(batch)
+            except requests.RequestException as e:
+                self.batches_failed += 1
+                print(f"Webhook delivery of {len(batch)} events failed: {e}")
@@ -0,0 +1,93 @@
+"""
+Micro-benchmark of the per-frame post-processing in detect_objects.py.
+
+Builds synthetic YOLO results with hundreds of boxes (on the GPU when one is
+available) and times turning them into person boxes and confidences the old
+way, indexing the device tensors once per detection, against person_arrays,
+which copies the frame's boxes to the host once and filters them with a mask.
+Then times a full process_detections pass (tracking, action dispatch,
+drawing) on top of it, with no person callback.
+
+Usage: python benchmark_postprocess.py [num_boxes ...]
+"""
+
+import sys
+import time
+import types
+
+import numpy as np
+import torch
+from ultralytics.engine.results import Boxes
+
+from actions import ActionDispatcher
+from detect_objects import person_arrays, process_detections
+from tracker import PersonTracker
+
+FRAME_SHAPE = (1080, 1920)
+
+
+def synthetic_results(num_boxes, device, seed=0):
+    """One frame's results: num_boxes random boxes, about half of them people."""
+    generator = torch.Generator().manual_seed(seed)
+    height, width = FRAME_SHAPE
+    xy = torch.rand(num_boxes, 2, generator=generator) * torch.tensor([width - 100, height - 200])
+    wh = torch.rand(num_boxes, 2, generator=generator) * torch.tensor([60, 150]) + 20
+    conf = torch.rand(num_boxes, 1, generator=generator) * 0.75 + 0.25
+    cls = torch.randint(0, 2, (num_boxes, 1), generator=generator).float()
+    data = torch.cat([xy, xy + wh, conf, cls], dim=1).to(device)
+    return types.SimpleNamespace(boxes=Boxes(data, FRAME_SHAPE))
+
+
+def per_detection_arrays(detections):
+    """The previous extraction: three small device->host copies per detection."""
+    bboxes = []
+    confs = []
+    for i in range(len(detections.boxes)):
+        if int(detections.boxes.cls[i]) == 0:
+            bboxes.append(detections.boxes.xyxy[i].cpu().numpy())
+            confs.append(detections.boxes.conf[i].cpu().numpy())
+    return np.array(bboxes, dtype=np.float32).reshape(-1, 4), np.array(confs, dtype=np.float32)
+
+
+def time_per_frame(fn, repeats):
+    fn()  # warm up
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) / repeats * 1000
+
+
+def main(box_counts):
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"Post-processing per frame on {device} results ({FRAME_SHAPE[1]}x{FRAME_SHAPE[0]})")
+    actions = ActionDispatcher()
+
+    for num_boxes in box_counts:
+        detections = synthetic_results(num_boxes, device)
+        repeats = max(10, 5000 // num_boxes)
+
+        old_boxes, old_confs = per_detection_arrays(detections)
+        new_boxes, new_confs = person_arrays(detections)
+        assert np.allclose(old_boxes, new_boxes) and np.allclose(old_confs, new_confs)
+
+        per_detection_ms = time_per_frame(lambda: per_detection_arrays(detections), repeats)
+        bulk_ms = time_per_frame(lambda: person_arrays(detections), repeats)
+
+        frame = np.zeros((*FRAME_SHAPE, 3), dtype=np.uint8)
+        tracker = PersonTracker()
+        full_ms = time_per_frame(
+            lambda: process_detections(frame, detections, tracker, time.time(), actions), repeats
+        )
+        print(
+            f"{num_boxes:5d} boxes ({len(new_boxes)} people): "
+            f"per-detection {per_detection_ms:8.2f}ms | bulk {bulk_ms:6.3f}ms "
+            f"({per_detection_ms / bulk_ms:.0f}x) | "
+            f"full process_detections {full_ms:6.2f}ms"
+        )
+    actions.close()
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [10, 100, 300, 1000])
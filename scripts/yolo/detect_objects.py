@@ -1,8 +1,15 @@
 import cv2
+import numpy as np
+import threading
 import time
+from pathlib import Path
 from ultralytics import YOLO
 from huggingface_hub import hf_hub_download
 
+from actions import ActionDispatcher
+from pipeline import FrameQueue, StageStats, format_report, run_source, run_stage, start_thread
+from tracker import PersonTracker
+
 # Mock function to simulate getting frames from a camera
 # Replace this with actual camera code for production
 def get_frame_from_camera(frame_counter=0):
@@ -23,7 +30,7 @@ def get_frame_from_camera(frame_counter=0):
     mock_image = cv2.imread('input.jpg')
     if mock_image is None:
         print("Warning: Mock image not found, creating blank frame")
-        mock_image = cv2.zeros((480, 640, 3), dtype=np.uint8)
+        mock_image = np.zeros((480, 640, 3), dtype=np.uint8)
         cv2.putText(mock_image, "MOCK CAMERA", (100, 240), 
                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
     return mock_image
@@ -34,6 +41,9 @@ def execute_action_on_person_detected(frame, detection_info, person_id, frame_ti
     Mock function to execute an action when a person is detected.
     Replace this with your actual action logic (e.g., send alert, save video, etc.)
     
+    Runs on an ActionDispatcher worker thread, at most once per cooldown for
+    each person, with a copy of the frame.
+    
     Args:
         frame (numpy.ndarray): The frame where person was detected
         detection_info (dict): Detection details including bounding box
@@ -48,25 +58,8 @@ def execute_action_on_person_detected(frame, detection_info, person_id, frame_ti
     print(f"  - Timestamp: {frame_timestamp}")
     print("="*50 + "\n")
     
-    # Example actions (uncomment to enable):
-    
-    # 1. Save person crop to file
-    # x1, y1, x2, y2 = detection_info['bbox']
-    # person_crop = frame[y1:y2, x1:x2]
-    # cv2.imwrite(f'person_detected_{person_id}_{frame_timestamp:.0f}.jpg', person_crop)
-    
-    # 2. Send HTTP request to webhook
-    # import requests
-    # requests.post("http://webhook.example.com/person-detected", json={
-    #     "person_id": person_id,
-    #     "bbox": detection_info['bbox'],
-    #     "confidence": detection_info['confidence'],
-    #     "timestamp": frame_timestamp
-    # })
-    
-    # 3. Log to file
-    # with open('detection_log.txt', 'a') as f:
-    #     f.write(f"{frame_timestamp:.0f} - Person {person_id} detected at ({x1},{y1})\n")
+    # Saving person crops, webhook POSTs (batched) and logging to a file are
+    # built into ActionDispatcher, see CROP_DIR, WEBHOOK_URL and LOG_PATH below.
 
 # Global YOLO model instance (load once, reuse)
 model = None
@@ -83,137 +76,445 @@ def load_model(repo_id='Ultralytics/YOLO26', filename='yolo26n.pt'):
     model = YOLO(model_path)
     return model
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def read_frames(source=None, fps=None, max_frames=None):
+    """
+    Yield (frame_counter, frame) pairs from a video source.
+    
+    Args:
+        source (str | int): Directory of images (read in name order), or a
+            video file, stream URL (e.g. rtsp://) or camera index for
+            cv2.VideoCapture; None uses the mock camera
+        fps (int): Pace frames to this rate (None reads as fast as possible)
+        max_frames (int): Maximum frames to read (None for infinite)
+    """
+    capture = None
+    images = None
+    if isinstance(source, str) and Path(source).is_dir():
+        images = iter(sorted(
+            path for path in Path(source).iterdir()
+            if path.suffix.lower() in IMAGE_EXTENSIONS
+        ))
+    elif source is not None:
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise IOError(f"Could not open video source {source!r}")
+    
+    frame_interval = 1.0 / fps if fps else 0.0
+    start_time = time.time()
+    frame_counter = 0
+    try:
+        while not max_frames or frame_counter < max_frames:
+            if images is not None:
+                path = next(images, None)
+                frame = cv2.imread(str(path)) if path is not None else None
+            elif capture is None:
+                frame = get_frame_from_camera(frame_counter)
+            else:
+                ok, frame = capture.read()
+                if not ok:
+                    frame = None
+            if frame is None:
+                print("Could not get frame, stopping...")
+                break
+            
+            yield frame_counter, frame
+            frame_counter += 1
+            
+            # Rate limiting
+            if frame_interval:
+                sleep_time = frame_counter * frame_interval - (time.time() - start_time)
+                if sleep_time > 0:
+                    time.sleep(sleep_time)
+        else:
+            print(f"Reached max frames ({max_frames}), stopping...")
+    finally:
+        if capture is not None:
+            capture.release()
+
+def person_arrays(detections):
+    """
+    Bounding boxes and confidences of the people in one frame's results.
+    
+    The frame's boxes are copied to the host in one transfer and filtered by
+    class with a boolean mask, instead of indexing device tensors (and
+    syncing) once per detection.
+    
+    Returns:
+        tuple: (N, 4) xyxy boxes and (N,) confidences, as NumPy arrays
+    """
+    if detections.boxes is None:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32)
+    boxes = detections.boxes.cpu().numpy()
+    # Class 0 = person in COCO dataset
+    people = boxes.cls == 0
+    return boxes.xyxy[people], boxes.conf[people]
+
+def process_detections(frame, detections, tracker, current_time, actions, source=None):
+    """
+    Track, draw and act on the people found in one frame.
+    
+    Actions are dispatched before anything is drawn, so crops are clean.
+    
+    Returns:
+        bool: Whether any person was detected
+    """
+    bboxes, confs = person_arrays(detections)
+    
+    # Match all of the frame's people to tracks at once (also ages out
+    # tracks, so it runs on frames without people too)
+    person_ids = tracker.update(bboxes)
+    
+    confs = confs.tolist()
+    person_ids = person_ids.tolist()
+    for bbox, conf, person_id in zip(bboxes.tolist(), confs, person_ids):
+        # Create detection info
+        detection_info = {
+            'bbox': bbox,
+            'confidence': conf,
+            'class': 'person'
+        }
+        
+        # Execute action for each person detected (debounced per person,
+        # the actual work runs in the background)
+        actions.dispatch(frame, detection_info, person_id, current_time, source)
+    
+    # Draw detections on frame
+    for (x1, y1, x2, y2), conf, person_id in zip(bboxes.astype(np.int32).tolist(), confs, person_ids):
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(frame, f"Person {person_id}: {conf:.0%}", (x1, y1 - 10),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    
+    return len(bboxes) > 0
+
+def draw_status(frame, frame_counter, people_detected, fps_actual):
+    """Display frame count, detection status and achieved FPS."""
+    status = "PERSON DETECTED!" if people_detected else "No person"
+    cv2.putText(frame, f"Frame: {frame_counter} | {status}", (10, 30),
+               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+    cv2.putText(frame, f"FPS: {fps_actual:.1f}", (10, 60),
+               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
+def show_frame(frame, window='Person Detection'):
+    """
+    Show frame in a window.
+    
+    Returns:
+        bool: False when the user pressed 'q'
+    """
+    cv2.imshow(window, frame)
+    
+    # Check for escape key
+    if cv2.waitKey(1) & 0xFF == ord('q'):
+        print("User pressed 'q', stopping...")
+        return False
+    return True
+
 def detect_and_stream(repo_id='Ultralytics/YOLO26', filename='yolo26n.pt', 
-                      fps=15, max_frames=None):
+                      fps=15, max_frames=None, source=None, headless=False, actions=None):
     """
     Stream frames from camera and detect people.
     
+    Capture, inference and rendering run one after the other on this thread,
+    see detect_and_stream_pipelined for the overlapped version.
+    
     Args:
         repo_id (str): Hugging Face repository ID
         filename (str): Model file name
         fps (int): Frames per second to process
         max_frames (int): Maximum frames to process (None for infinite)
+        source (str | int): Video file, stream URL or camera index (None for the mock camera)
+        headless (bool): Don't open a window
+        actions (ActionDispatcher): Runs person actions, closed when the
+            stream ends (None for just execute_action_on_person_detected)
     """
     global model
     model = load_model(repo_id, filename)
+    actions = actions or ActionDispatcher(on_person=execute_action_on_person_detected)
     
     print("\nStarting person detection stream...")
     print("Press Ctrl+C to stop\n")
     
-    frame_counter = 0
-    person_id_counter = 0
-    frame_interval = 1.0 / fps
+    processed = 0
     start_time = time.time()
-    
-    # Track active persons for simple ID assignment
-    active_persons = {}  # bbox_center -> person_id
+    tracker = PersonTracker()
     
     try:
-        while True:
-            # Check if we should stop
-            if max_frames and frame_counter >= max_frames:
-                print(f"Reached max frames ({max_frames}), stopping...")
-                break
-            
-            # Get frame from camera (using mock function)
-            frame = get_frame_from_camera(frame_counter)
-            if frame is None:
-                print("Could not get frame, stopping...")
-                break
-            
+        for frame_counter, frame in read_frames(source, fps, max_frames):
             # Run YOLO inference
             results = model.predict(source=frame, conf=0.25, verbose=False)
             detections = results[0]
             
-            # Process detections for people (class 0 = person in COCO dataset)
-            people_detected = False
             current_time = time.time()
+            people_detected = process_detections(frame, detections, tracker, current_time, actions)
+            
+            fps_actual = processed / (current_time - start_time) if current_time > start_time else 0
+            draw_status(frame, frame_counter, people_detected, fps_actual)
+            processed += 1
+            
+            if not headless and not show_frame(frame):
+                break
             
-            if detections.boxes is not None:
-                for i in range(len(detections.boxes)):
-                    # Check if detection is a person (class 0)
-                    if int(detections.boxes.cls[i]) == 0:
-                        people_detected = True
-                        
-                        # Get bounding box and confidence
-                        bbox = detections.boxes.xyxy[i].cpu().numpy()
-                        conf = detections.boxes.conf[i].cpu().numpy()
-                        center_x = (bbox[0] + bbox[2]) / 2
-                        center_y = (bbox[1] + bbox[3]) / 2
-                        
-                        # Simple person tracking by proximity
-                        # Find closest existing person ID
-                        found_id = None
-                        min_distance = float('inf')
-                        for center, pid in active_persons.items():
-                            dist = ((center[0] - center_x)**2 + (center[1] - center_y)**2)**0.5
-                            if dist < 50:  # Threshold for same person
-                                if dist < min_distance:
-                                    min_distance = dist
-                                    found_id = pid
-                        
-                        if found_id is not None:
-                            # Update position
-                            active_persons[(center_x, center_y)] = found_id
-                            person_id = found_id
-                        else:
-                            # New person
-                            person_id = person_id_counter
-                            person_id_counter += 1
-                            active_persons[(center_x, center_y)] = person_id
-                        
-                        # Create detection info
-                        detection_info = {
-                            'bbox': bbox.tolist(),
-                            'confidence': conf,
-                            'class': 'person'
-                        }
-                        
-                        # Draw detection on frame
-                        cv2.rectangle(frame, (int(bbox[0]), int(bbox[1])), 
-                                    (int(bbox[2]), int(bbox[3])), (0, 255, 0), 2)
-                        cv2.putText(frame, f"Person {person_id}: {conf:.0%}",
-                                   (int(bbox[0]), int(bbox[1]) - 10),
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                        
-                        # Execute action for each person detected
-                        execute_action_on_person_detected(frame, detection_info, person_id, current_time)
+    except KeyboardInterrupt:
+        print("\nInterrupted by user (Ctrl+C)")
+    finally:
+        cv2.destroyAllWindows()
+        actions.close()
+        print(f"Processed {processed} frames total")
+        print(actions.describe())
+
+def detect_and_stream_pipelined(repo_id='Ultralytics/YOLO26', filename='yolo26n.pt',
+                                fps=None, max_frames=None, source=None, headless=False,
+                                queue_size=2, drop_frames=True, report_interval=5.0,
+                                actions=None):
+    """
+    Stream frames and detect people with capture, inference and
+    render/action stages running concurrently.
+    
+    Capture and inference run on their own threads, render/action on this one
+    (OpenCV windows want the main thread). Capture hands frames over through a
+    queue that drops its oldest frame when full, so inference always works on
+    the freshest frame; inference hands results over with backpressure, so
+    every inferred frame is rendered and acted on.
+    
+    Args:
+        repo_id (str): Hugging Face repository ID
+        filename (str): Model file name
+        fps (int): Capture pacing (None reads as fast as possible)
+        max_frames (int): Maximum frames to capture (None for infinite)
+        source (str | int): Video file, stream URL or camera index (None for the mock camera)
+        headless (bool): Don't open a window
+        queue_size (int): Capacity of each queue between stages
+        drop_frames (bool): Drop the oldest frame when inference falls behind;
+            False makes capture wait instead, to process every frame of a file
+        report_interval (float): Seconds between stage/queue reports
+        actions (ActionDispatcher): Runs person actions, closed when the
+            stream ends (None for just execute_action_on_person_detected)
+    """
+    global model
+    model = load_model(repo_id, filename)
+    actions = actions or ActionDispatcher(on_person=execute_action_on_person_detected)
+    
+    print("\nStarting pipelined person detection stream...")
+    print("Press Ctrl+C to stop\n")
+    
+    frames = FrameQueue("capture -> inference", queue_size, drop_oldest=drop_frames)
+    results = FrameQueue("inference -> render", queue_size, drop_oldest=False)
+    capture_stats = StageStats("capture")
+    inference_stats = StageStats("inference")
+    render_stats = StageStats("render")
+    stages = [capture_stats, inference_stats, render_stats]
+    queues = [frames, results]
+    
+    def infer(item):
+        frame_counter, frame = item
+        detections = model.predict(source=frame, conf=0.25, verbose=False)[0]
+        return frame_counter, frame, detections
+    
+    stop = threading.Event()
+    threads = [
+        start_thread("capture", run_source, read_frames(source, None, max_frames),
+                     frames, capture_stats, stop, fps),
+        start_thread("inference", run_stage, infer, frames, results, inference_stats),
+    ]
+    
+    tracker = PersonTracker()
+    start_time = time.time()
+    last_report = start_time
+    try:
+        while True:
+            item = results.get()
+            if item is None:
+                break
+            stage_start = time.perf_counter()
+            frame_counter, frame, detections = item
             
-            # Display frame count and status
-            status = "PERSON DETECTED!" if people_detected else "No person"
-            fps_actual = frame_counter / (current_time - start_time) if current_time > start_time else 0
-            cv2.putText(frame, f"Frame: {frame_counter} | {status}", (10, 30),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            cv2.putText(frame, f"FPS: {fps_actual:.1f}", (10, 60),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+            current_time = time.time()
+            people_detected = process_detections(frame, detections, tracker, current_time, actions)
             
-            # Show frame (comment out for headless mode)
-            cv2.imshow('Person Detection', frame)
+            elapsed = current_time - start_time
+            fps_actual = render_stats.count / elapsed if elapsed > 0 else 0
+            draw_status(frame, frame_counter, people_detected, fps_actual)
             
-            # Check for escape key
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                print("User pressed 'q', stopping...")
+            if not headless and not show_frame(frame):
                 break
+            render_stats.record(time.perf_counter() - stage_start)
             
-            # Rate limiting
-            elapsed = time.time() - start_time
-            target_time = frame_counter * frame_interval
-            sleep_time = target_time - elapsed
-            if sleep_time > 0:
-                time.sleep(sleep_time)
+            if report_interval and current_time - last_report >= report_interval:
+                last_report = current_time
+                print(format_report(elapsed, stages, queues))
+                print(actions.describe())
             
-            frame_counter += 1
+    except KeyboardInterrupt:
+        print("\nInterrupted by user (Ctrl+C)")
+    finally:
+        stop.set()
+        for q in queues:
+            q.close(discard=True)
+        for thread in threads:
+            thread.join()
+        cv2.destroyAllWindows()
+        actions.close()
+        print(format_report(time.time() - start_time, stages, queues))
+        print(actions.describe())
+        print(f"Processed {render_stats.count} of {capture_stats.count} captured frames")
+
+def detect_multi_stream(sources, repo_id='Ultralytics/YOLO26', filename='yolo26n.pt',
+                        fps=None, max_frames=None, headless=False, drop_frames=True,
+                        report_interval=5.0, actions=None):
+    """
+    Detect people on several video sources at once with one model.
+    
+    Every source is read on its own capture thread into a one-frame queue.
+    Whenever frames are ready, the latest frame of every source that has one
+    goes into a single batched model.predict call, and the results are
+    tracked, drawn and acted on per source, so one model instance serves all
+    cameras and the batch grows with the number of busy ones.
+    
+    Args:
+        sources (list): Directories of images, video files, stream URLs or
+            camera indexes, see read_frames
+        repo_id (str): Hugging Face repository ID
+        filename (str): Model file name
+        fps (int): Capture pacing per source (None reads as fast as possible)
+        max_frames (int): Maximum frames to capture per source (None for infinite)
+        headless (bool): Don't open windows
+        drop_frames (bool): Replace a source's waiting frame with its newest;
+            False makes capture wait instead, to process every frame of files
+        report_interval (float): Seconds between throughput reports
+        actions (ActionDispatcher): Runs person actions for all sources,
+            closed when the stream ends (None for just
+            execute_action_on_person_detected)
+    """
+    global model
+    model = load_model(repo_id, filename)
+    actions = actions or ActionDispatcher(on_person=execute_action_on_person_detected)
+    
+    print(f"\nStarting person detection on {len(sources)} sources...")
+    print("Press Ctrl+C to stop\n")
+    
+    ready = threading.Event()
+    stop = threading.Event()
+    queues = [FrameQueue(f"camera {i}", 1, drop_oldest=drop_frames, ready=ready)
+              for i in range(len(sources))]
+    capture_stats = [StageStats(f"camera {i} capture") for i in range(len(sources))]
+    trackers = [PersonTracker() for _ in sources]
+    processed = [0] * len(sources)
+    inference_stats = StageStats("batched inference", unit="batches")
+    render_stats = StageStats("render", unit="batches")
+    
+    threads = [
+        start_thread(f"capture-{i}", run_source, read_frames(source, None, max_frames),
+                     queues[i], capture_stats[i], stop, fps)
+        for i, source in enumerate(sources)
+    ]
+    
+    def report(elapsed):
+        total = sum(processed)
+        avg_batch = total / inference_stats.count if inference_stats.count else 0.0
+        lines = [
+            f"--- {len(sources)} sources after {elapsed:.1f}s: "
+            f"{total / elapsed if elapsed > 0 else 0:.1f} frames/s total, "
+            f"avg batch {avg_batch:.1f} ---",
+            inference_stats.describe(elapsed),
+            render_stats.describe(elapsed),
+            actions.describe(),
+        ]
+        for i, source in enumerate(sources):
+            lines.append(
+                f"camera {i} ({source}): {processed[i]} frames "
+                f"({processed[i] / elapsed if elapsed > 0 else 0:.1f}/s) | "
+                f"captured {capture_stats[i].count} dropped {queues[i].drops} "
+                f"| read avg {capture_stats[i].total_s / max(capture_stats[i].count, 1) * 1000:.1f}ms"
+            )
+        return "\n".join(lines)
+    
+    start_time = time.time()
+    last_report = start_time
+    try:
+        while True:
+            # Clear before polling, so a frame arriving meanwhile sets it again
+            ready.clear()
+            batch = []
+            for i, q in enumerate(queues):
+                item = q.take()
+                if item is not None:
+                    batch.append((i, *item))
+            if not batch:
+                if all(q.done for q in queues):
+                    break
+                ready.wait(0.5)
+                continue
+            
+            stage_start = time.perf_counter()
+            results = model.predict(source=[frame for _, _, frame in batch],
+                                    conf=0.25, verbose=False)
+            inference_stats.record(time.perf_counter() - stage_start)
+            
+            stage_start = time.perf_counter()
+            current_time = time.time()
+            elapsed = current_time - start_time
+            keep_going = True
+            for (i, frame_counter, frame), detections in zip(batch, results):
+                people_detected = process_detections(frame, detections, trackers[i], current_time,
+                                                     actions, source=i)
+                fps_actual = processed[i] / elapsed if elapsed > 0 else 0
+                draw_status(frame, frame_counter, people_detected, fps_actual)
+                processed[i] += 1
+                if not headless:
+                    keep_going = show_frame(frame, f"Person Detection - camera {i}") and keep_going
+            render_stats.record(time.perf_counter() - stage_start)
+            if not keep_going:
+                break
+            
+            if report_interval and current_time - last_report >= report_interval:
+                last_report = current_time
+                print(report(elapsed))
             
     except KeyboardInterrupt:
         print("\nInterrupted by user (Ctrl+C)")
     finally:
+        stop.set()
+        for q in queues:
+            q.close(discard=True)
+        for thread in threads:
+            thread.join()
         cv2.destroyAllWindows()
-        print(f"Processed {frame_counter} frames total")
+        actions.close()
+        print(report(time.time() - start_time))
 
 if __name__ == "__main__":
     # Configuration
     FPS = 15  # Frames per second to process
     MAX_FRAMES = None  # Set to number to limit frames, None for infinite
+    SOURCE = None  # Video file, stream URL or camera index, None for the mock camera
+    HEADLESS = False  # True to run without a window
+    PIPELINED = False  # True to overlap capture, inference and rendering
+    SOURCES = []  # Several sources to batch through one model, overrides SOURCE
+    
+    # Person actions, each person fires at most once per ACTION_COOLDOWN_S
+    ACTION_COOLDOWN_S = 5.0
+    CROP_DIR = None  # e.g. 'detections', to save person crops
+    WEBHOOK_URL = None  # e.g. "http://webhook.example.com/person-detected"
+    LOG_PATH = None  # e.g. 'detection_log.txt'
+    actions = ActionDispatcher(
+        on_person=execute_action_on_person_detected,
+        cooldown_s=ACTION_COOLDOWN_S,
+        crop_dir=CROP_DIR,
+        webhook_url=WEBHOOK_URL,
+        log_path=LOG_PATH,
+    )
     
     # Run detection stream
-    detect_and_stream(fps=FPS, max_frames=MAX_FRAMES)
+    if SOURCES:
+        detect_multi_stream(SOURCES, fps=FPS, max_frames=MAX_FRAMES, headless=HEADLESS,
+                            actions=actions)
+    elif PIPELINED:
+        detect_and_stream_pipelined(fps=FPS, max_frames=MAX_FRAMES, source=SOURCE,
+                                    headless=HEADLESS, actions=actions)
+    else:
+        detect_and_stream(fps=FPS, max_frames=MAX_FRAMES, source=SOURCE, headless=HEADLESS,
+                          actions=actions)
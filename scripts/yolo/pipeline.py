@@ -0,0 +1,189 @@
+"""
+Threaded stage pipeline used by detect_objects.py.
+
+Each stage runs on its own thread and hands its output to the next one through
+a small bounded FrameQueue, so capture, inference and rendering overlap and
+throughput is bounded by the slowest stage instead of the sum of all of them.
+A queue either drops its oldest item when full (so a slow consumer always gets
+the freshest frame) or blocks the producer (backpressure, nothing is lost).
+
+Every stage records how long it spends per item and every queue how full it
+is, for the periodic report.
+
+A stage fed by several queues (one per camera) passes them a shared ready
+event, set on every put, and polls them with take() whenever it is set.
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class FrameQueue:
+    """Bounded queue between two stages."""
+
+    def __init__(self, name, maxsize=1, drop_oldest=True, ready=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        self.ready = ready
+        self.closed = False
+        self._items = deque()
+        self._cond = threading.Condition()
+
+        self.puts = 0
+        self.drops = 0
+        self.max_depth = 0
+        self._depth_total = 0
+
+    def put(self, item):
+        """
+        Add an item, dropping the oldest one or waiting for room when full.
+
+        Returns False if the queue was closed and the item discarded.
+        """
+        with self._cond:
+            while not self.drop_oldest and len(self._items) >= self.maxsize and not self.closed:
+                self._cond.wait()
+            if self.closed:
+                return False
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.drops += 1
+            self._items.append(item)
+            self.puts += 1
+            self._depth_total += len(self._items)
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._cond.notify_all()
+        if self.ready is not None:
+            self.ready.set()
+        return True
+
+    def get(self):
+        """Next item, or None once the queue is closed and empty."""
+        with self._cond:
+            while not self._items and not self.closed:
+                self._cond.wait()
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def take(self):
+        """Next item without waiting, None if there is none."""
+        with self._cond:
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    @property
+    def done(self):
+        """Closed and drained: no item will ever come out again."""
+        return self.closed and not self._items
+
+    def close(self, discard=False):
+        """No more items: consumers drain what's left (or nothing, with discard) and stop."""
+        with self._cond:
+            self.closed = True
+            if discard:
+                self._items.clear()
+            self._cond.notify_all()
+        if self.ready is not None:
+            self.ready.set()
+
+    def describe(self):
+        avg_depth = self._depth_total / self.puts if self.puts else 0.0
+        return (
+            f"{self.name}: depth {len(self._items)}/{self.maxsize} "
+            f"avg {avg_depth:.2f} max {self.max_depth} | dropped {self.drops}/{self.puts}"
+        )
+
+
+class StageStats:
+    """Time spent per item by one stage."""
+
+    def __init__(self, name, unit="frames"):
+        self.name = name
+        self.unit = unit
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.last_s = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total_s += seconds
+        self.max_s = max(self.max_s, seconds)
+        self.last_s = seconds
+
+    def describe(self, elapsed_s):
+        avg_ms = self.total_s / self.count * 1000 if self.count else 0.0
+        rate = self.count / elapsed_s if elapsed_s > 0 else 0.0
+        return (
+            f"{self.name}: {self.count} {self.unit} ({rate:.1f}/s) | "
+            f"avg {avg_ms:.1f}ms max {self.max_s * 1000:.1f}ms last {self.last_s * 1000:.1f}ms"
+        )
+
+
+def run_source(items, outbox, stats, stop, fps=None):
+    """
+    Stage thread feeding an iterator's items into outbox until it is
+    exhausted or stop is set, at most fps items per second. Time spent
+    producing each item (not pacing) is recorded.
+    """
+    iterator = iter(items)
+    interval = 1.0 / fps if fps else 0.0
+    start_time = time.perf_counter()
+    try:
+        while not stop.is_set():
+            if interval:
+                sleep_time = start_time + stats.count * interval - time.perf_counter()
+                if sleep_time > 0:
+                    time.sleep(sleep_time)
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            stats.record(time.perf_counter() - started)
+            if not outbox.put(item):
+                break
+    finally:
+        # Release the source (e.g. a generator's VideoCapture) on this thread
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+        outbox.close()
+
+
+def run_stage(fn, inbox, outbox, stats):
+    """Stage thread applying fn to every item of inbox and passing results on."""
+    try:
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+            started = time.perf_counter()
+            result = fn(item)
+            stats.record(time.perf_counter() - started)
+            if result is not None and not outbox.put(result):
+                break
+    finally:
+        outbox.close()
+
+
+def start_thread(name, target, *args):
+    thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def format_report(elapsed_s, stages, queues):
+    """Per-stage latency and queue occupancy, one line each."""
+    lines = [f"--- pipeline after {elapsed_s:.1f}s ---"]
+    lines += [stage.describe(elapsed_s) for stage in stages]
+    lines += [q.describe() for q in queues]
+    return "\n".join(lines)
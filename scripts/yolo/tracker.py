@@ -0,0 +1,174 @@
+"""
+Person tracker for detect_objects.py.
+
+Each frame, all detections are matched against all live tracks at once: the
+IoU and center distance between every track and every detection are computed
+as NumPy matrices, combined into one cost matrix and solved as an assignment
+problem (optimal with SciPy's Hungarian solver when SciPy is installed, greedy
+lowest-cost-first otherwise). Matched tracks take the detection's box,
+unmatched detections start new tracks, and tracks not seen for max_age frames
+expire, so the table only ever holds people seen recently and the per-frame
+cost stays bounded however long the stream runs.
+
+Tracks live in a compact table of preallocated arrays: the first `count` rows
+are live, and expiring tracks compacts the survivors to the front.
+"""
+
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # SciPy comes with ultralytics, but is optional here
+    linear_sum_assignment = None
+
+# Cost of a track/detection pair that is not allowed to match
+UNMATCHABLE = 1e6
+
+
+def iou_matrix(a, b):
+    """IoU between every box of a (N, 4) and of b (M, 4), xyxy, as (N, M)."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+def center_distance_matrix(a, b):
+    """Euclidean distance between every box center of a (N, 4) and of b (M, 4)."""
+    centers_a = (a[:, :2] + a[:, 2:]) / 2
+    centers_b = (b[:, :2] + b[:, 2:]) / 2
+    return np.linalg.norm(centers_a[:, None, :] - centers_b[None, :, :], axis=2)
+
+
+def greedy_assignment(cost):
+    """Row/column pairs taken lowest cost first, each row and column at most once."""
+    rows, cols = [], []
+    used_rows = np.zeros(cost.shape[0], dtype=bool)
+    used_cols = np.zeros(cost.shape[1], dtype=bool)
+    for flat in np.argsort(cost, axis=None):
+        r, c = divmod(int(flat), cost.shape[1])
+        if cost[r, c] >= UNMATCHABLE:
+            break
+        if used_rows[r] or used_cols[c]:
+            continue
+        used_rows[r] = used_cols[c] = True
+        rows.append(r)
+        cols.append(c)
+        if len(rows) == min(cost.shape):
+            break
+    return np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)
+
+
+class PersonTracker:
+    """
+    IoU/distance tracker assigning stable IDs to person boxes across frames.
+
+    Args:
+        iou_threshold (float): Minimum IoU for a detection to continue a track
+        max_distance (float): Or maximum center distance in pixels
+        max_age (int): Frames a track survives without a matching detection
+        method (str): "hungarian" (optimal, needs SciPy) or "greedy"
+        capacity (int): Initial size of the track table (grows as needed)
+    """
+
+    def __init__(self, iou_threshold=0.3, max_distance=50.0, max_age=30,
+                 method="hungarian", capacity=64):
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_age = max_age
+        self.method = method if linear_sum_assignment is not None else "greedy"
+
+        self.boxes = np.zeros((capacity, 4), dtype=np.float32)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.last_seen = np.zeros(capacity, dtype=np.int64)
+        self.hits = np.zeros(capacity, dtype=np.int64)
+        self.count = 0
+
+        self.frame_index = 0
+        self.next_id = 0
+
+    def __len__(self):
+        return self.count
+
+    def update(self, boxes):
+        """
+        Match one frame's detections to tracks.
+
+        Args:
+            boxes (numpy.ndarray): (N, 4) xyxy boxes of the frame's people
+
+        Returns:
+            numpy.ndarray: (N,) person ID of every box
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        ids = np.empty(len(boxes), dtype=np.int64)
+        matched = np.zeros(len(boxes), dtype=bool)
+
+        if self.count and len(boxes):
+            rows, cols = self._assign(self.boxes[:self.count], boxes)
+            self.boxes[rows] = boxes[cols]
+            self.last_seen[rows] = self.frame_index
+            self.hits[rows] += 1
+            ids[cols] = self.ids[rows]
+            matched[cols] = True
+
+        # Expire before adding, new tracks can reuse the freed rows
+        self._expire()
+        new = np.flatnonzero(~matched)
+        if len(new):
+            start = self._reserve(len(new))
+            rows = np.arange(start, start + len(new))
+            ids[new] = np.arange(self.next_id, self.next_id + len(new))
+            self.next_id += len(new)
+            self.boxes[rows] = boxes[new]
+            self.ids[rows] = ids[new]
+            self.last_seen[rows] = self.frame_index
+            self.hits[rows] = 1
+
+        self.frame_index += 1
+        return ids
+
+    def _assign(self, track_boxes, boxes):
+        iou = iou_matrix(track_boxes, boxes)
+        distance = center_distance_matrix(track_boxes, boxes)
+        cost = (1.0 - iou) + distance / self.max_distance
+        gate = (iou >= self.iou_threshold) | (distance < self.max_distance)
+        cost = np.where(gate, cost, UNMATCHABLE)
+
+        if self.method == "hungarian":
+            rows, cols = linear_sum_assignment(cost)
+            keep = cost[rows, cols] < UNMATCHABLE
+            return rows[keep], cols[keep]
+        return greedy_assignment(cost)
+
+    def _expire(self):
+        live = self.frame_index - self.last_seen[:self.count] <= self.max_age
+        if live.all():
+            return
+        keep = np.flatnonzero(live)
+        n = len(keep)
+        # Compact the live rows to the front of the table
+        self.boxes[:n] = self.boxes[keep]
+        self.ids[:n] = self.ids[keep]
+        self.last_seen[:n] = self.last_seen[keep]
+        self.hits[:n] = self.hits[keep]
+        self.count = n
+
+    def _reserve(self, n):
+        """Make room for n more tracks, returning the first new row."""
+        needed = self.count + n
+        if needed > len(self.ids):
+            capacity = max(needed, 2 * len(self.ids))
+            for name in ("boxes", "ids", "last_seen", "hits"):
+                old = getattr(self, name)
+                grown = np.zeros((capacity, *old.shape[1:]), dtype=old.dtype)
+                grown[:self.count] = old[:self.count]
+                setattr(self, name, grown)
+        start = self.count
+        self.count = needed
+        return start
@@ -1,46 +1,80 @@
 #!/usr/bin/env python3
 """
 Parallel async requests to LLM chat completions endpoint.
-Usage: python parallel_requests.py --model MODEL --content CONTENT --num-requests N --max-tokens T --url URL
+Usage: python parallel_requests.py --model MODEL --content CONTENT --num-requests N --max-tokens T --url URL [URL ...]
+
+Open-loop mode (requests sent at a target rate, regardless of response times):
+  python parallel_requests.py --rate 4 --arrival poisson --num-requests 200
+  python parallel_requests.py --ramp 1:30,2:30,4:30,8:30 --arrival poisson
+
+Dataset or synthetic workloads instead of one repeated --content string:
+  python parallel_requests.py --dataset sharegpt.json --tokenizer Qwen/Qwen3-0.6B --num-requests 500
+  python parallel_requests.py --synthetic-input lognormal:6:0.8 --synthetic-output uniform:64:512
+
+Prefix cache benchmark (cold vs warm shared prefixes, --max-tokens small keeps it quick):
+  python parallel_requests.py --prefix-cache --prefix-kind few-shot --num-requests 3 --max-tokens 16
+
+Closed-loop concurrency sweep (to size vLLM --max-num-seqs):
+  python parallel_requests.py --sweep 64 --num-requests 64 --slo-ttft-ms 2000
 """
 
 import argparse
 import asyncio
+import csv
 import json
+import math
+import multiprocessing
+import os
+import random
+import re
 import sys
+import threading
 import time
+from itertools import islice
+from typing import Awaitable, Callable, Iterator
+from urllib.parse import urlsplit
 
 import aiohttp
 
+from workloads import (
+    dataset_prompts,
+    fixed_prompts,
+    load_tokenizer,
+    parse_distribution,
+    prefix_group,
+    synthetic_prompts,
+)
+
 
 async def send_request(
     session: aiohttp.ClientSession,
     url: str,
     model: str,
-    content: str,
-    max_tokens: int,
+    prompt: dict,
     request_id: int,
+    stream: bool = False,
 ) -> dict:
-    """Send a single chat completions request."""
+    """Send a single chat completions request for a workload prompt."""
     payload = {
         "model": model,
-        "messages": [
-            {
-                "role": "user",
-                "content": content,
-            }
-        ],
-        "max_tokens": max_tokens,
+        "messages": prompt["messages"],
+        "max_tokens": prompt["max_tokens"],
     }
-
-    headers = {"Content-Type": "application/json"}
+    if prompt.get("ignore_eos"):
+        payload["ignore_eos"] = True
+    if stream:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
 
     try:
         start = time.monotonic()
-        async with session.post(url, json=payload, headers=headers) as response:
+        async with session.post(url, json=payload) as response:
+            if stream and response.status == 200:
+                result = await read_stream(response, request_id, start)
+                return with_prompt_lengths(result, prompt)
             result = await response.json()
             elapsed_ms = (time.monotonic() - start) * 1000
-            return {
+            return with_prompt_lengths({
                 "request_id": request_id,
                 "status": response.status,
                 "response": result,
@@ -53,13 +87,163 @@ async def send_request(
                     else ""
                 ),
                 "response_time_ms": round(elapsed_ms, 1),
-            }
+            }, prompt)
     except aiohttp.ClientError as e:
         return {"request_id": request_id, "status": None, "error": str(e)}
     except Exception as e:
         return {"request_id": request_id, "status": None, "error": str(e)}
 
 
+def with_prompt_lengths(result: dict, prompt: dict) -> dict:
+    """Attach the locally measured prompt/expected output lengths to a result."""
+    for key in ("input_len", "output_len"):
+        if prompt.get(key) is not None:
+            result[key] = prompt[key]
+    return result
+
+
+async def read_stream(
+    response: aiohttp.ClientResponse,
+    request_id: int,
+    start: float,
+) -> dict:
+    """
+    Consume an OpenAI-style text/event-stream response incrementally.
+
+    Records the arrival time of every chunk carrying generated text (content or
+    reasoning) and derives TTFT, inter-token latencies and decode throughput.
+    """
+    usage = {}
+    parts = []
+    chunk_times = []
+    async for raw_line in response.content:
+        line = raw_line.strip()
+        if not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            break
+        now = time.monotonic()
+        chunk = json.loads(data)
+        if chunk.get("usage"):
+            usage = chunk["usage"]
+        for choice in chunk.get("choices") or []:
+            delta = choice.get("delta", {})
+            text = delta.get("content") or ""
+            reasoning = delta.get("reasoning_content") or delta.get("reasoning") or ""
+            if text or reasoning:
+                chunk_times.append(now)
+            parts.append(text)
+    end = time.monotonic()
+
+    # Without include_usage support every chunk is assumed to be one token.
+    completion_tokens = usage.get("completion_tokens") or len(chunk_times)
+    ttft_ms = (chunk_times[0] - start) * 1000 if chunk_times else None
+    itl_ms = [round((b - a) * 1000, 2) for a, b in zip(chunk_times, chunk_times[1:])]
+    decode_s = end - chunk_times[0] if chunk_times else 0
+    return {
+        "request_id": request_id,
+        "status": response.status,
+        "usage": usage,
+        "content": "".join(parts),
+        "response_time_ms": round((end - start) * 1000, 1),
+        "ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+        "itl_ms": itl_ms,
+        # The first token belongs to TTFT; throughput covers the remaining ones.
+        "output_tokens_per_s": (
+            round((completion_tokens - 1) / decode_s, 2) if decode_s > 0 else None
+        ),
+        "chunk_times_ms": [round((t - start) * 1000, 1) for t in chunk_times],
+    }
+
+
+class Client:
+    """
+    Connection settings plus a pool of backend URLs with request routing.
+
+    One client process can drive several vLLM replicas: each request goes to the
+    next URL in turn ("round-robin") or to the backend with the fewest requests
+    in flight ("least-outstanding").
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        policy: str = "round-robin",
+        limit: int = 0,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 60.0,
+        force_close: bool = False,
+        dns_ttl: int | None = 300,
+        timeout: float | None = None,
+        connect_timeout: float | None = None,
+        read_timeout: float | None = None,
+    ):
+        self.urls = urls
+        self.policy = policy
+        # limit=0 (unbounded) by default: aiohttp's default cap of 100 in-flight
+        # connections would make the client, not the server, the bottleneck.
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.force_close = force_close
+        self.dns_ttl = dns_ttl
+        # No total timeout by default, long generations easily exceed aiohttp's 5 minutes.
+        self.timeout = aiohttp.ClientTimeout(
+            total=timeout, connect=connect_timeout, sock_read=read_timeout
+        )
+        self.outstanding = {url: 0 for url in urls}
+        self.max_outstanding = {url: 0 for url in urls}
+        self._next = 0
+
+    def session(self) -> aiohttp.ClientSession:
+        """Create a session sharing one pooled connector across all backends."""
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            # keepalive_timeout can't be combined with force_close.
+            **({"force_close": True} if self.force_close else {"keepalive_timeout": self.keepalive_timeout}),
+            use_dns_cache=self.dns_ttl is not None,
+            ttl_dns_cache=self.dns_ttl,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            headers={"Content-Type": "application/json"},
+        )
+
+    def pick(self) -> str:
+        if self.policy == "least-outstanding":
+            # Scan from the round-robin cursor so ties rotate between backends.
+            n = len(self.urls)
+            order = [self.urls[(self._next + i) % n] for i in range(n)]
+            url = min(order, key=lambda u: self.outstanding[u])
+        else:
+            url = self.urls[self._next % len(self.urls)]
+        self._next += 1
+        return url
+
+    async def send(
+        self,
+        session: aiohttp.ClientSession,
+        model: str,
+        prompt: dict,
+        request_id: int,
+        stream: bool = False,
+        url: str | None = None,
+    ) -> dict:
+        """Route one request to a backend (or the given one) and tag the result with it."""
+        url = url or self.pick()
+        self.outstanding[url] += 1
+        self.max_outstanding[url] = max(self.max_outstanding[url], self.outstanding[url])
+        try:
+            result = await send_request(session, url, model, prompt, request_id, stream=stream)
+        finally:
+            self.outstanding[url] -= 1
+        result["backend"] = url
+        return result
+
+
 def format_result(r: dict) -> str:
     """Format a single request result with stats and content."""
     rid = r["request_id"]
@@ -73,6 +257,11 @@ def format_result(r: dict) -> str:
     lines = [
         f"─" * 60,
         f"Request #{rid}  status={status}  response_time={r.get('response_time_ms', 0)}ms",
+        *(
+            [f"  ttft={r['ttft_ms']}ms  tokens_per_s={r.get('output_tokens_per_s')}"]
+            if r.get("ttft_ms") is not None
+            else []
+        ),
         f"  prompt_tokens={prompt_tokens}  completion_tokens={completion_tokens}  total_tokens={total_tokens}",
         f"  content: {content[:300]}{'...' if len(content) > 300 else ''}",
         f"",
@@ -80,54 +269,921 @@ def format_result(r: dict) -> str:
     return "\n".join(lines)
 
 
+class Histogram:
+    """
+    Log-bucketed histogram in the spirit of HdrHistogram.
+
+    Bucket width grows with the magnitude of the value, so every reported
+    percentile is within `precision` (relative) of the recorded value while
+    memory stays bounded no matter how many samples are recorded.
+    """
+
+    def __init__(self, precision: float = 0.01):
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value: float):
+        # Shift by one so that zero (e.g. completion_tokens) has a bucket too.
+        bucket = int(math.log1p(max(value, 0.0)) / self._log_base)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "Histogram"):
+        for bucket, n in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + n
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def value_at_percentile(self, pct: float) -> float:
+        """Highest value equivalent to the bucket holding the given percentile."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * pct / 100))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                upper = math.expm1((bucket + 1) * self._log_base)
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+# Per-request fields summarized as histograms, in display order.
+HISTOGRAM_METRICS = (
+    "response_time_ms",
+    "ttft_ms",
+    "itl_ms",
+    "output_tokens_per_s",
+    "prompt_tokens",
+    "completion_tokens",
+)
+
+
+def build_histograms(results: list[dict]) -> dict[str, Histogram]:
+    """Record latency and token metrics of successful requests into histograms."""
+    histograms = {metric: Histogram() for metric in HISTOGRAM_METRICS}
+    for r in results:
+        if r["status"] != 200:
+            continue
+        usage = r.get("usage", {})
+        values = {
+            "response_time_ms": [r.get("response_time_ms")],
+            "ttft_ms": [r.get("ttft_ms")],
+            "itl_ms": r.get("itl_ms", []),
+            "output_tokens_per_s": [r.get("output_tokens_per_s")],
+            "prompt_tokens": [usage.get("prompt_tokens")],
+            "completion_tokens": [usage.get("completion_tokens")],
+        }
+        for metric, samples in values.items():
+            for value in samples:
+                if value is not None:
+                    histograms[metric].record(value)
+    return {metric: h for metric, h in histograms.items() if h.count}
+
+
+def pct_label(pct: float) -> str:
+    return f"p{pct:g}".replace(".", "_")
+
+
+def summarize(results: list[dict], histograms: dict[str, Histogram] | None = None) -> dict:
+    """Build a flat summary record (token totals, status counts and percentiles)."""
+    if histograms is None:
+        histograms = build_histograms(results)
+    usage = [r.get("usage", {}) for r in results]
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+
+    summary = {
+        "record": "summary",
+        "requests": len(results),
+        "succeeded": statuses.get("200", 0),
+        "failed": len(results) - statuses.get("200", 0),
+        "statuses": statuses,
+        "total_prompt_tokens": sum(u.get("prompt_tokens", 0) for u in usage),
+        "total_completion_tokens": sum(u.get("completion_tokens", 0) for u in usage),
+        "total_tokens": sum(u.get("total_tokens", 0) for u in usage),
+    }
+    for metric, h in histograms.items():
+        summary[f"{metric}_mean"] = round(h.mean, 2)
+        for pct in PERCENTILES:
+            summary[f"{metric}_{pct_label(pct)}"] = round(h.value_at_percentile(pct), 2)
+        summary[f"{metric}_max"] = round(h.max, 2)
+    return summary
+
+
 def print_summary(results: list[dict]):
-    """Print overall summary stats."""
-    total_prompt = sum(r.get("usage", {}).get("prompt_tokens", 0) for r in results)
-    total_completion = sum(r.get("usage", {}).get("completion_tokens", 0) for r in results)
-    total_all = sum(r.get("usage", {}).get("total_tokens", 0) for r in results)
-    statuses = [r["status"] for r in results]
-    successes = sum(1 for s in statuses if s == 200)
-    total_time = sum(r.get("response_time_ms", 0) for r in results)
-    avg_time = total_time / len(results) if results else 0
+    """Print overall summary stats and percentile histograms."""
+    histograms = build_histograms(results)
+    summary = summarize(results, histograms)
+    n = len(results)
 
     lines = [
         f"═" * 60,
-        f"SUMMARY  ({len(results)} requests, {successes} succeeded, {len(results)-successes} failed)",
-        f"  total_prompt_tokens={total_prompt}",
-        f"  total_completion_tokens={total_completion}",
-        f"  total_tokens={total_all}",
-        f"  avg_prompt_tokens={total_prompt // len(results) if results else 0}",
-        f"  avg_completion_tokens={total_completion // len(results) if results else 0}",
-        f"  avg_response_time={avg_time:.1f}ms",
-        f"  statuses={statuses}",
+        f"SUMMARY  ({n} requests, {summary['succeeded']} succeeded, {summary['failed']} failed)",
+        f"  total_prompt_tokens={summary['total_prompt_tokens']}",
+        f"  total_completion_tokens={summary['total_completion_tokens']}",
+        f"  total_tokens={summary['total_tokens']}",
+        f"  avg_prompt_tokens={summary['total_prompt_tokens'] // n if n else 0}",
+        f"  avg_completion_tokens={summary['total_completion_tokens'] // n if n else 0}",
+        f"  statuses={summary['statuses']}",
+        f"",
+        f"  {'metric':<20}{'mean':>9}"
+        + "".join(f"{pct_label(p):>9}" for p in PERCENTILES)
+        + f"{'max':>9}",
+    ]
+    for metric, h in histograms.items():
+        lines.append(
+            f"  {metric:<20}{h.mean:>9.1f}"
+            + "".join(f"{h.value_at_percentile(p):>9.1f}" for p in PERCENTILES)
+            + f"{h.max:>9.1f}"
+        )
+    lines.append(f"═" * 60)
+    print("\n".join(lines))
+    return summary
+
+
+def print_backend_summary(results: list[dict], client: Client):
+    """Print request counts, latency percentiles and peak in-flight requests per backend."""
+    if len(client.urls) < 2:
+        return
+    width = max(len(url) for url in client.urls) + 2
+    lines = [
         f"═" * 60,
+        f"BACKENDS  (routing={client.policy})",
+        f"  {'backend':<{width}}{'reqs':>6}{'ok':>6}{'p50_ms':>9}{'p99_ms':>9}{'peak':>6}",
     ]
+    for url in client.urls:
+        backend_results = [r for r in results if r.get("backend") == url]
+        latency = build_histograms(backend_results).get("response_time_ms", Histogram())
+        ok = sum(1 for r in backend_results if r["status"] == 200)
+        lines.append(
+            f"  {url:<{width}}{len(backend_results):>6}{ok:>6}"
+            f"{latency.value_at_percentile(50):>9.1f}{latency.value_at_percentile(99):>9.1f}"
+            f"{client.max_outstanding[url]:>6}"
+        )
+    lines.append(f"═" * 60)
     print("\n".join(lines))
 
 
+def result_row(r: dict) -> dict:
+    """Flatten a per-request result into an export row (raw response body dropped)."""
+    row = {"record": "request"}
+    row.update((k, v) for k, v in r.items() if k not in ("response", "usage"))
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        row[key] = r.get("usage", {}).get(key)
+    return row
+
+
+def write_jsonl(path: str, results: list[dict], summary: dict):
+    """Write one JSON line per request followed by the summary record."""
+    with open(path, "w") as f:
+        for r in results:
+            f.write(json.dumps(result_row(r)) + "\n")
+        f.write(json.dumps(summary) + "\n")
+
+
+def write_csv(path: str, results: list[dict], summary: dict):
+    """Write one CSV row per request plus a summary row over the union of columns."""
+    # Per-chunk lists don't fit a CSV cell; they are kept in the JSONL export.
+    skip = ("itl_ms", "chunk_times_ms")
+    rows = [{k: v for k, v in result_row(r).items() if k not in skip} for r in results]
+    rows.append(
+        {k: json.dumps(v) if isinstance(v, (dict, list)) else v for k, v in summary.items()}
+    )
+    fieldnames = list(dict.fromkeys(k for row in rows for k in row))
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def export_results(args: argparse.Namespace, results: list[dict], summary: dict):
+    if args.jsonl:
+        write_jsonl(args.jsonl, results, summary)
+        print(f"Wrote {args.jsonl}", file=sys.stderr)
+    if args.csv:
+        write_csv(args.csv, results, summary)
+        print(f"Wrote {args.csv}", file=sys.stderr)
+
+
 async def run_parallel_requests(
-    url: str,
+    client: Client,
     model: str,
-    content: str,
-    max_tokens: int,
+    prompts: Iterator[dict],
     num_requests: int,
+    stream: bool = False,
+    shard: tuple[int, int] = (0, 1),
+    start_barrier: Callable[[], Awaitable[None]] | None = None,
 ) -> list[dict]:
-    """Run N parallel requests and return all results."""
-    async with aiohttp.ClientSession() as session:
-        tasks = [
-            send_request(session, url, model, content, max_tokens, i)
-            for i in range(num_requests)
-        ]
+    """
+    Run N parallel requests and return all results.
+
+    With shard=(k, K) only every K-th request starting at k is sent, keeping
+    the global request ids, so K processes together send the full workload.
+    The shard is built before start_barrier, outside the timed section.
+    """
+    work = list(islice(zip(range(num_requests), prompts), shard[0], None, shard[1]))
+    async with client.session() as session:
+        if start_barrier is not None:
+            await start_barrier()
+        tasks = [client.send(session, model, prompt, i, stream=stream) for i, prompt in work]
         results = await asyncio.gather(*tasks)
         return list(results)
 
 
+def parse_ramp(spec: str) -> list[tuple[float, float]]:
+    """Parse a 'rate:seconds,rate:seconds' ramp spec into (rate, seconds) stages."""
+    stages = []
+    for part in spec.split(","):
+        rate, _, seconds = part.strip().partition(":")
+        if not seconds:
+            raise ValueError(f"invalid ramp stage '{part}', expected RATE:SECONDS")
+        stages.append((float(rate), float(seconds)))
+    if any(rate <= 0 or seconds <= 0 for rate, seconds in stages):
+        raise ValueError(f"invalid ramp '{spec}', rates and durations must be > 0")
+    return stages
+
+
+def arrival_offsets(
+    stages: list[tuple[float, float | None]],
+    arrival: str,
+    rng: random.Random,
+) -> Iterator[tuple[int, float]]:
+    """
+    Yield (stage_index, offset_seconds) send times for an open-loop schedule.
+
+    Inter-arrival gaps are 1/rate for "constant" and exponentially distributed
+    with mean 1/rate for "poisson". A stage with a duration of None never ends.
+    """
+    stage_start = 0.0
+    for stage, (rate, seconds) in enumerate(stages):
+        stage_end = None if seconds is None else stage_start + seconds
+        t = stage_start
+        while True:
+            t += rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+            if stage_end is not None and t >= stage_end:
+                break
+            yield stage, t
+        stage_start = stage_end
+
+
+async def run_open_loop(
+    client: Client,
+    model: str,
+    prompts: Iterator[dict],
+    stages: list[tuple[float, float | None]],
+    arrival: str = "poisson",
+    num_requests: int | None = None,
+    seed: int | None = None,
+    stream: bool = False,
+    shard: tuple[int, int] = (0, 1),
+    start_barrier: Callable[[], Awaitable[None]] | None = None,
+) -> tuple[list[dict], float]:
+    """
+    Send requests on an open-loop arrival schedule and return (results, elapsed_s).
+
+    Requests are dispatched at their scheduled time whether or not earlier ones
+    have completed, so slow responses never throttle the offered load. With
+    shard=(k, K) every process computes the same seeded schedule and sends
+    every K-th arrival, so K processes together reproduce it exactly. With a
+    start_barrier, the shard's arrivals and prompts are built before it, so
+    the timed loop only sleeps and sends.
+    """
+    rng = random.Random(seed)
+    arrivals = islice(arrival_offsets(stages, arrival, rng), num_requests)
+    work = islice(enumerate(zip(arrivals, prompts)), shard[0], None, shard[1])
+    if start_barrier is not None:
+        work = list(work)
+    async with client.session() as session:
+        if start_barrier is not None:
+            await start_barrier()
+        start = time.monotonic()
+
+        async def fire(request_id: int, prompt: dict, stage: int, offset: float) -> dict:
+            sent = time.monotonic() - start
+            result = await client.send(session, model, prompt, request_id, stream=stream)
+            result.update(
+                stage=stage,
+                scheduled_s=round(offset, 4),
+                sent_s=round(sent, 4),
+                finished_s=round(time.monotonic() - start, 4),
+            )
+            return result
+
+        tasks = []
+        for request_id, ((stage, offset), prompt) in work:
+            delay = offset - (time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(fire(request_id, prompt, stage, offset)))
+
+        results = await asyncio.gather(*tasks)
+        return list(results), time.monotonic() - start
+
+
+def print_open_loop_summary(
+    results: list[dict],
+    stages: list[tuple[float, float | None]],
+    elapsed_s: float,
+):
+    """Print offered vs achieved QPS per stage and overall."""
+    lines = [
+        f"═" * 60,
+        f"OPEN LOOP  ({len(results)} requests in {elapsed_s:.1f}s)",
+        f"  {'stage':>5} {'offered':>9} {'sent':>9} {'achieved':>9} {'ok':>6} {'lag_p99':>9}",
+    ]
+    stage_start = 0.0
+    for stage, (rate, seconds) in enumerate(stages):
+        stage_results = [r for r in results if r["stage"] == stage]
+        if not stage_results:
+            continue
+        # An unbounded stage lasts as long as it took to schedule its requests.
+        window = seconds if seconds is not None else max(r["scheduled_s"] for r in stage_results)
+        ok = [r for r in stage_results if r["status"] == 200]
+        done_window = max(r["finished_s"] for r in stage_results) - stage_start
+        lags = Histogram()
+        for r in stage_results:
+            lags.record((r["sent_s"] - r["scheduled_s"]) * 1000)
+        lag_p99 = lags.value_at_percentile(99)
+        lines.append(
+            f"  {stage:>5} {rate:>9.2f} {len(stage_results) / window:>9.2f}"
+            f" {len(ok) / done_window:>9.2f} {len(ok):>6} {lag_p99:>7.1f}ms"
+        )
+        stage_start += window
+
+    ok_total = sum(1 for r in results if r["status"] == 200)
+    last_sent = max((r["sent_s"] for r in results), default=0.0)
+    lines += [
+        f"  offered_qps={len(results) / last_sent if last_sent else 0:.2f}",
+        f"  achieved_qps={ok_total / elapsed_s if elapsed_s else 0:.2f}",
+        f"═" * 60,
+    ]
+    print("\n".join(lines))
+
+
+def sweep_levels(max_concurrency: int) -> list[int]:
+    """Powers of two up to max_concurrency, always ending at max_concurrency."""
+    levels = []
+    level = 1
+    while level < max_concurrency:
+        levels.append(level)
+        level *= 2
+    return levels + [max_concurrency]
+
+
+def meets_slo(r: dict, slo_latency_ms: float | None, slo_ttft_ms: float | None) -> bool:
+    if r["status"] != 200:
+        return False
+    if slo_latency_ms is not None and r["response_time_ms"] > slo_latency_ms:
+        return False
+    if slo_ttft_ms is not None and (r.get("ttft_ms") is None or r["ttft_ms"] > slo_ttft_ms):
+        return False
+    return True
+
+
+async def run_closed_loop(
+    client: Client,
+    session: aiohttp.ClientSession,
+    model: str,
+    prompts: Iterator[dict],
+    concurrency: int,
+    num_requests: int,
+    stream: bool = False,
+    first_id: int = 0,
+) -> tuple[list[dict], float]:
+    """
+    Run num_requests through a pool of `concurrency` workers and return (results, elapsed_s).
+
+    Request ids are numbered from first_id.
+    """
+    work = zip(range(first_id, first_id + num_requests), prompts)
+    results = []
+
+    async def worker():
+        # Workers share one iterator, so each request id is sent exactly once.
+        for request_id, prompt in work:
+            result = await client.send(session, model, prompt, request_id, stream=stream)
+            result["concurrency"] = concurrency
+            results.append(result)
+
+    start = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.monotonic() - start
+
+
+async def run_sweep(
+    client: Client,
+    model: str,
+    prompts: Iterator[dict],
+    max_concurrency: int,
+    requests_per_level: int,
+    slo_latency_ms: float | None = None,
+    slo_ttft_ms: float | None = None,
+    slo_target: float = 0.9,
+    plateau: float = 0.05,
+    stream: bool = False,
+) -> tuple[list[dict], dict]:
+    """
+    Sweep closed-loop concurrency 1, 2, 4 ... max_concurrency.
+
+    Stops at the first level whose SLO attainment drops below slo_target, or
+    whose goodput improves by less than `plateau` (relative) over the best level
+    so far. Returns (all results, sweep report).
+    """
+    all_results = []
+    levels = []
+    best = None
+    stop_reason = "max_concurrency"
+    async with client.session() as session:
+        for concurrency in sweep_levels(max_concurrency):
+            results, elapsed_s = await run_closed_loop(
+                client,
+                session,
+                model,
+                prompts,
+                concurrency,
+                max(requests_per_level, concurrency),
+                stream=stream,
+                # Ids keep counting across levels, so exported rows stay unique.
+                first_id=len(all_results),
+            )
+            all_results.extend(results)
+            summary = summarize(results)
+            good = sum(1 for r in results if meets_slo(r, slo_latency_ms, slo_ttft_ms))
+            level = {
+                "concurrency": concurrency,
+                "requests": len(results),
+                "elapsed_s": round(elapsed_s, 2),
+                "throughput_rps": round(summary["succeeded"] / elapsed_s, 3),
+                "goodput_rps": round(good / elapsed_s, 3),
+                "slo_attainment": round(good / len(results), 3),
+                "output_tokens_per_s": round(summary["total_completion_tokens"] / elapsed_s, 1),
+                "response_time_ms_p50": summary.get("response_time_ms_p50"),
+                "response_time_ms_p99": summary.get("response_time_ms_p99"),
+                "ttft_ms_p99": summary.get("ttft_ms_p99"),
+            }
+            levels.append(level)
+            print_sweep_level(level)
+
+            if level["slo_attainment"] < slo_target:
+                stop_reason = "slo_violated"
+                break
+            if best is not None and level["goodput_rps"] < best["goodput_rps"] * (1 + plateau):
+                stop_reason = "throughput_plateau"
+                break
+            best = level
+
+    report = {
+        "max_sustainable_concurrency": best["concurrency"] if best else None,
+        "max_goodput_rps": best["goodput_rps"] if best else None,
+        "stop_reason": stop_reason,
+        "slo": {
+            "latency_ms": slo_latency_ms,
+            "ttft_ms": slo_ttft_ms,
+            "target": slo_target,
+            "plateau": plateau,
+        },
+        "levels": levels,
+    }
+    return all_results, report
+
+
+def print_sweep_header():
+    print(
+        f"{'conc':>6} {'reqs':>6} {'rps':>9} {'goodput':>9} {'slo_ok':>7}"
+        f" {'tok/s':>9} {'p50_ms':>9} {'p99_ms':>9} {'ttft_p99':>9}"
+    )
+
+
+def print_sweep_level(level: dict):
+    ttft = level["ttft_ms_p99"]
+    print(
+        f"{level['concurrency']:>6} {level['requests']:>6} {level['throughput_rps']:>9.2f}"
+        f" {level['goodput_rps']:>9.2f} {level['slo_attainment']:>7.1%}"
+        f" {level['output_tokens_per_s']:>9.1f} {level['response_time_ms_p50'] or 0:>9.1f}"
+        f" {level['response_time_ms_p99'] or 0:>9.1f} {ttft if ttft is not None else '-':>9}"
+    )
+
+
+PREFIX_CACHE_METRIC = re.compile(
+    r"^vllm:(?:gpu_)?prefix_cache_(hits|queries)(?:_total)?(?:\{[^}]*\})?\s+([0-9.eE+-]+)"
+)
+
+
+def metrics_url(url: str) -> str:
+    """The Prometheus endpoint served next to an OpenAI API URL."""
+    parsed = urlsplit(url)
+    return f"{parsed.scheme}://{parsed.netloc}/metrics"
+
+
+async def scrape_prefix_cache(session: aiohttp.ClientSession, urls: list[str]) -> dict | None:
+    """
+    Sum vLLM's prefix cache hit/query token counters over all backends.
+
+    Returns None when no backend exposes them (metrics disabled, older vLLM or
+    another server).
+    """
+    totals = {"hits": 0.0, "queries": 0.0}
+    found = False
+    for url in urls:
+        try:
+            async with session.get(metrics_url(url)) as response:
+                if response.status != 200:
+                    continue
+                text = await response.text()
+        except aiohttp.ClientError:
+            continue
+        for line in text.splitlines():
+            match = PREFIX_CACHE_METRIC.match(line)
+            if match:
+                totals[match.group(1)] += float(match.group(2))
+                found = True
+    return totals if found else None
+
+
+async def run_prefix_cache_bench(
+    client: Client,
+    model: str,
+    kind: str,
+    prompt_len: int,
+    fractions: list[float],
+    groups: int,
+    warm_per_group: int,
+    max_tokens: int,
+    seed: int | None = None,
+) -> tuple[list[dict], list[dict]]:
+    """
+    Measure TTFT with cold vs warm shared prefixes for each shared fraction.
+
+    Each group builds a fresh random prefix, sends one request that finds it
+    cold, then warm_per_group requests reusing it, all sequentially so TTFT is
+    not inflated by queueing. Groups rotate over backends but a group stays on
+    one backend, since the prefix cache is per replica. Returns (results, one
+    report row per fraction).
+    """
+    rng = random.Random(seed)
+    results = []
+    rows = []
+    request_id = 0
+    async with client.session() as session:
+        for fraction in fractions:
+            before = await scrape_prefix_cache(session, client.urls)
+            fraction_results = []
+            for group in range(groups):
+                url = client.urls[group % len(client.urls)]
+                prompts = prefix_group(kind, prompt_len, fraction, 1 + warm_per_group, max_tokens, rng)
+                for i, prompt in enumerate(prompts):
+                    result = await client.send(session, model, prompt, request_id, stream=True, url=url)
+                    result.update(
+                        shared_fraction=fraction,
+                        prefix_group=group,
+                        prefix_state="cold" if i == 0 else "warm",
+                    )
+                    fraction_results.append(result)
+                    request_id += 1
+            after = await scrape_prefix_cache(session, client.urls)
+            results.extend(fraction_results)
+
+            row = {"shared_fraction": fraction, "shared_words": round(prompt_len * fraction)}
+            for state in ("cold", "warm"):
+                ttft = build_histograms(
+                    [r for r in fraction_results if r["prefix_state"] == state]
+                ).get("ttft_ms", Histogram())
+                row[f"{state}_ttft_ms_p50"] = round(ttft.value_at_percentile(50), 1)
+                row[f"{state}_ttft_ms_mean"] = round(ttft.mean, 1)
+            row["ttft_saved_ms"] = round(row["cold_ttft_ms_mean"] - row["warm_ttft_ms_mean"], 1)
+            row["warm_speedup"] = (
+                round(row["cold_ttft_ms_mean"] / row["warm_ttft_ms_mean"], 2)
+                if row["warm_ttft_ms_mean"]
+                else None
+            )
+            # None only when the counters weren't found; 0 hits is a result.
+            row["server_hit_tokens"] = row["server_query_tokens"] = row["server_hit_rate"] = None
+            if before and after:
+                hits = after["hits"] - before["hits"]
+                queries = after["queries"] - before["queries"]
+                row["server_hit_tokens"] = int(hits)
+                row["server_query_tokens"] = int(queries)
+                row["server_hit_rate"] = round(hits / queries, 3) if queries else 0.0
+            rows.append(row)
+            print_prefix_cache_row(row)
+    return results, rows
+
+
+def print_prefix_cache_header():
+    print(
+        f"{'shared':>7} {'words':>6} {'cold_p50':>9} {'warm_p50':>9}"
+        f" {'saved_ms':>9} {'speedup':>8} {'hit_tok':>9} {'hit_rate':>9}"
+    )
+
+
+def print_prefix_cache_row(row: dict):
+    hits = row["server_hit_tokens"]
+    hit_rate = row["server_hit_rate"]
+    print(
+        f"{row['shared_fraction']:>7.0%} {row['shared_words']:>6}"
+        f" {row['cold_ttft_ms_p50']:>9.1f} {row['warm_ttft_ms_p50']:>9.1f}"
+        f" {row['ttft_saved_ms']:>9.1f} {row['warm_speedup'] or 0:>7.2f}x"
+        f" {hits if hits is not None else '-':>9}"
+        f" {f'{hit_rate:.1%}' if hit_rate is not None else '-':>9}"
+    )
+
+
+# How long processes wait for each other at the start barrier (tokenizer
+# loading and building the shard happen before it), and the lead time given
+# to reach the start time.
+BARRIER_TIMEOUT_S = 300
+START_DELAY_S = 0.5
+
+
+async def run_shard(
+    args: argparse.Namespace,
+    stages: list[tuple[float, float | None]] | None,
+    shard: tuple[int, int],
+    barrier,
+    start_at,
+) -> tuple[list[dict], float | None, dict[str, int]]:
+    """Run one process's shard of the workload with its own event loop and session."""
+    client = build_client(args)
+    prompts = build_workload(args)
+
+    async def start_barrier():
+        # Phase 1: every process has its session. Phase 2: the parent has
+        # published the shared start time.
+        await asyncio.to_thread(barrier.wait, BARRIER_TIMEOUT_S)
+        await asyncio.to_thread(barrier.wait, BARRIER_TIMEOUT_S)
+        # The wall clock is read once to find the common start instant; every
+        # measurement after it is a monotonic delta local to this process, so
+        # clock skew or NTP steps can't distort the merged timings.
+        await asyncio.sleep(max(0.0, start_at.value - time.time()))
+
+    elapsed_s = None
+    if stages is not None:
+        results, elapsed_s = await run_open_loop(
+            client,
+            args.model,
+            prompts,
+            stages,
+            arrival=args.arrival,
+            num_requests=None if args.ramp else args.num_requests,
+            seed=args.seed,
+            stream=args.stream,
+            shard=shard,
+            start_barrier=start_barrier,
+        )
+    else:
+        results = await run_parallel_requests(
+            client,
+            args.model,
+            prompts,
+            args.num_requests,
+            stream=args.stream,
+            shard=shard,
+            start_barrier=start_barrier,
+        )
+    for r in results:
+        r["worker"] = shard[0]
+    return results, elapsed_s, client.max_outstanding
+
+
+def worker_main(args, stages, shard, barrier, start_at, out):
+    """Process entry point: run a shard and send (index, output, error) back to the parent."""
+    try:
+        out.put((shard[0], asyncio.run(run_shard(args, stages, shard, barrier, start_at)), None))
+    except BaseException as e:
+        barrier.abort()
+        out.put((shard[0], None, f"{type(e).__name__}: {e}"))
+
+
+def run_workers(
+    args: argparse.Namespace,
+    stages: list[tuple[float, float | None]] | None,
+) -> tuple[list[dict], float | None, dict[str, int]]:
+    """
+    Shard the workload across args.workers processes and merge their results.
+
+    Returns (results ordered by request id, elapsed_s of the slowest worker or
+    None in burst mode, per-backend peak in-flight requests summed over workers).
+    """
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(args.workers + 1)
+    start_at = ctx.Value("d", 0.0)
+    out = ctx.Queue()
+    procs = [
+        ctx.Process(
+            target=worker_main,
+            args=(args, stages, (k, args.workers), barrier, start_at, out),
+        )
+        for k in range(args.workers)
+    ]
+    for proc in procs:
+        proc.start()
+
+    try:
+        barrier.wait(BARRIER_TIMEOUT_S)
+        start_at.value = time.time() + START_DELAY_S
+        barrier.wait(BARRIER_TIMEOUT_S)
+    except threading.BrokenBarrierError:
+        pass  # A worker failed during setup, its error arrives on the queue.
+
+    # Drain the queue before joining, a child blocks on exit until it's read.
+    outputs = [out.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    errors = [f"worker {k}: {error}" for k, _, error in outputs if error]
+    if errors:
+        raise RuntimeError("; ".join(errors))
+
+    results = []
+    elapsed = []
+    max_outstanding = {}
+    for _, (worker_results, elapsed_s, outstanding), _ in outputs:
+        results.extend(worker_results)
+        if elapsed_s is not None:
+            elapsed.append(elapsed_s)
+        for url, n in outstanding.items():
+            max_outstanding[url] = max_outstanding.get(url, 0) + n
+    results.sort(key=lambda r: r["request_id"])
+    return results, max(elapsed) if elapsed else None, max_outstanding
+
+
+def build_client(args: argparse.Namespace) -> Client:
+    return Client(
+        args.url,
+        policy=args.routing,
+        limit=args.connector_limit,
+        limit_per_host=args.connector_limit_per_host,
+        keepalive_timeout=args.keepalive_timeout,
+        force_close=args.no_keepalive,
+        dns_ttl=args.dns_ttl or None,
+        timeout=args.timeout,
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+    )
+
+
+def check_workload(args: argparse.Namespace):
+    """
+    Raise ValueError for a workload build_workload would reject, without
+    building it (a dataset is only read up to its first usable record).
+    """
+    if args.dataset:
+        if not os.path.isfile(args.dataset):
+            raise ValueError(f"dataset '{args.dataset}' not found")
+        # Read up to the first usable record, so an empty or unusable dataset
+        # fails here instead of after a whole pass, mid-run.
+        prompts = dataset_prompts(args.dataset, args.max_tokens)
+        try:
+            next(prompts)
+        finally:
+            prompts.close()
+    if args.synthetic_input:
+        parse_distribution(args.synthetic_input)
+        parse_distribution(args.synthetic_output)
+
+
+def build_workload(args: argparse.Namespace) -> Iterator[dict]:
+    """Build the lazy prompt iterator selected on the command line."""
+    check_workload(args)
+    if args.dataset:
+        prompts = dataset_prompts(args.dataset, args.max_tokens, load_tokenizer(args.tokenizer))
+    elif args.synthetic_input:
+        prompts = synthetic_prompts(
+            parse_distribution(args.synthetic_input),
+            parse_distribution(args.synthetic_output),
+            args.max_tokens,
+            tokenizer=load_tokenizer(args.tokenizer),
+            seed=args.seed,
+        )
+    else:
+        prompts = fixed_prompts(args.content, args.max_tokens)
+    if args.ignore_eos:
+        prompts = ({**prompt, "ignore_eos": True} for prompt in prompts)
+    return prompts
+
+
+def describe_workload(args: argparse.Namespace) -> str:
+    if args.dataset:
+        return f"dataset {args.dataset}"
+    if args.synthetic_input:
+        return f"synthetic input={args.synthetic_input} output={args.synthetic_output}"
+    return f"fixed content '{args.content}'"
+
+
 def main():
     parser = argparse.ArgumentParser(description="Parallel async LLM chat completions requests")
     parser.add_argument(
         "--url",
-        default="http://localhost:8000/v1/chat/completions",
-        help="API endpoint URL",
+        nargs="+",
+        default=["http://localhost:8000/v1/chat/completions"],
+        help="API endpoint URL(s); requests are spread across several backends with --routing",
+    )
+    parser.add_argument(
+        "--routing",
+        choices=["round-robin", "least-outstanding"],
+        default="round-robin",
+        help="How requests are assigned to backends when several --url are given",
+    )
+    parser.add_argument(
+        "--connector-limit",
+        type=int,
+        default=0,
+        help="Max open connections across all backends (0 = unlimited)",
+    )
+    parser.add_argument(
+        "--connector-limit-per-host",
+        type=int,
+        default=0,
+        help="Max open connections per backend (0 = unlimited)",
+    )
+    parser.add_argument(
+        "--keepalive-timeout",
+        type=float,
+        default=60.0,
+        help="Seconds an idle pooled connection is kept alive",
+    )
+    parser.add_argument(
+        "--no-keepalive",
+        action="store_true",
+        help="Close the connection after every request",
+    )
+    parser.add_argument(
+        "--dns-ttl",
+        type=int,
+        default=300,
+        help="Seconds DNS lookups are cached (0 disables the cache)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Total per-request timeout in seconds (default: none)",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=None,
+        help="Connection timeout in seconds, including waiting for a pooled connection",
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        default=None,
+        help="Max seconds between reads of a response (e.g. between streamed chunks)",
+    )
+    parser.add_argument(
+        "--prefix-cache",
+        action="store_true",
+        help="Prefix cache benchmark: compare TTFT of cold vs warm shared prefixes "
+        "(--num-requests prefix groups per shared fraction)",
+    )
+    parser.add_argument(
+        "--prefix-kind",
+        choices=["system", "few-shot", "multi-turn"],
+        default="system",
+        help="How the shared prefix is laid out in the conversation",
+    )
+    parser.add_argument(
+        "--prefix-fractions",
+        default="0,0.25,0.5,0.75,0.9",
+        help="Comma-separated fractions of each prompt that is shared",
+    )
+    parser.add_argument(
+        "--prefix-prompt-len",
+        type=int,
+        default=2048,
+        help="Prompt length in words (roughly tokens) for the prefix cache benchmark",
+    )
+    parser.add_argument(
+        "--prefix-warm",
+        type=int,
+        default=4,
+        help="Warm requests sent after the cold one in each prefix group",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Shard the workload across this many processes, each with its own "
+        "event loop and connection pool (burst and open-loop modes)",
     )
     parser.add_argument(
         "--model",
@@ -149,34 +1205,297 @@ def main():
         "--num-requests",
         type=int,
         default=1,
-        help="Number of parallel requests",
+        help="Number of parallel requests (in open-loop mode, requests to send at --rate)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Open-loop mode: target request rate in requests/second",
+    )
+    parser.add_argument(
+        "--ramp",
+        default=None,
+        help="Open-loop mode: rate stages as RATE:SECONDS[,RATE:SECONDS...], overrides --rate/--num-requests",
+    )
+    parser.add_argument(
+        "--arrival",
+        choices=["constant", "poisson"],
+        default="poisson",
+        help="Open-loop inter-arrival distribution",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Random seed for the open-loop arrival schedule, --synthetic-input prompts "
+        "and --prefix-cache prompt groups",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream responses (SSE) and report TTFT, inter-token latency and tokens/sec",
+    )
+    parser.add_argument(
+        "--jsonl",
+        default=None,
+        help="Export per-request results and a summary record as JSON Lines",
+    )
+    parser.add_argument(
+        "--csv",
+        default=None,
+        help="Export per-request results and a summary row as CSV",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Don't print individual request results",
+    )
+    parser.add_argument(
+        "--sweep",
+        type=int,
+        default=None,
+        metavar="MAX_CONCURRENCY",
+        help="Closed-loop sweep over concurrency 1, 2, 4 ... MAX_CONCURRENCY, "
+        "sending --num-requests per level (at least one per worker)",
+    )
+    parser.add_argument(
+        "--slo-latency-ms",
+        type=float,
+        default=None,
+        help="Sweep SLO: max end-to-end latency for a request to count towards goodput",
+    )
+    parser.add_argument(
+        "--slo-ttft-ms",
+        type=float,
+        default=None,
+        help="Sweep SLO: max time-to-first-token (implies --stream)",
+    )
+    parser.add_argument(
+        "--slo-target",
+        type=float,
+        default=0.9,
+        help="Sweep stops once fewer than this fraction of requests meet the SLO",
+    )
+    parser.add_argument(
+        "--plateau",
+        type=float,
+        default=0.05,
+        help="Sweep stops once goodput improves by less than this fraction over the best level",
+    )
+    parser.add_argument(
+        "--sweep-json",
+        default=None,
+        help="Write the sweep report to this file instead of stdout",
+    )
+    parser.add_argument(
+        "--dataset",
+        default=None,
+        help="JSONL/JSON prompt dataset (ShareGPT, OpenAI messages, prompt/completion "
+        "or title/body records), streamed lazily and looped; overrides --content",
+    )
+    parser.add_argument(
+        "--synthetic-input",
+        default=None,
+        help="Synthetic prompts with input lengths from fixed:N, uniform:LOW:HIGH, "
+        "normal:MEAN:STD or lognormal:MU:SIGMA (words, roughly one token each); "
+        "overrides --content",
+    )
+    parser.add_argument(
+        "--synthetic-output",
+        default="fixed:256",
+        help="Output length distribution in tokens for --synthetic-input "
+        "(capped at --max-tokens)",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        default=None,
+        help="Hugging Face tokenizer used to measure prompt/output lengths locally "
+        "(estimated from text length when omitted)",
+    )
+    parser.add_argument(
+        "--ignore-eos",
+        action="store_true",
+        help="Ask vLLM to ignore EOS so outputs reach the workload's max_tokens",
     )
 
     args = parser.parse_args()
 
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be > 0")
+    try:
+        stages = parse_ramp(args.ramp) if args.ramp else None
+    except ValueError as e:
+        parser.error(str(e))
+    if stages is None and args.rate is not None:
+        stages = [(args.rate, None)]
+
+    if args.workers < 1:
+        parser.error("--workers must be >= 1")
+    if args.workers > 1 and (args.sweep is not None or args.prefix_cache):
+        parser.error("--sweep and --prefix-cache run in a single process, drop --workers")
+    if args.workers > 1 and args.seed is None:
+        # Shards must agree on the arrival schedule and synthetic prompts.
+        args.seed = random.randrange(2**32)
+
+    client = build_client(args)
+
+    prompts = None
+    try:
+        if args.workers > 1:
+            # Each worker builds its own shard, the parent only validates.
+            check_workload(args)
+        elif not args.prefix_cache:
+            # The prefix cache benchmark generates its own prompt groups.
+            prompts = build_workload(args)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    if args.prefix_cache:
+        try:
+            fractions = [float(f) for f in args.prefix_fractions.split(",")]
+        except ValueError:
+            parser.error(f"invalid --prefix-fractions '{args.prefix_fractions}'")
+        if any(not 0 <= f < 1 for f in fractions):
+            parser.error("--prefix-fractions must be in [0, 1)")
+        print(
+            f"Prefix cache benchmark against {', '.join(args.url)}",
+            f"  model   : {args.model}",
+            f"  layout  : {args.prefix_kind}, {args.prefix_prompt_len} words/prompt",
+            f"  groups  : {args.num_requests} per fraction, 1 cold + {args.prefix_warm} warm each",
+            sep="\n",
+            file=sys.stderr,
+        )
+        print_prefix_cache_header()
+        results, rows = asyncio.run(
+            run_prefix_cache_bench(
+                client,
+                args.model,
+                args.prefix_kind,
+                args.prefix_prompt_len,
+                fractions,
+                args.num_requests,
+                args.prefix_warm,
+                args.max_tokens,
+                seed=args.seed,
+            )
+        )
+        if all(row["server_hit_tokens"] is None for row in rows):
+            print("(server prefix cache counters not found at /metrics)", file=sys.stderr)
+        summary = summarize(results)
+        summary["prefix_cache"] = rows
+        export_results(args, results, summary)
+        return
+
+    if args.sweep is not None:
+        if args.sweep < 1:
+            parser.error("--sweep must be >= 1")
+        if args.slo_ttft_ms is not None:
+            args.stream = True
+        print(
+            f"Concurrency sweep up to {args.sweep} against {', '.join(args.url)}",
+            f"  model   : {args.model}",
+            f"  requests/level: {args.num_requests}",
+            f"  workload: {describe_workload(args)}",
+            f"  slo     : latency<={args.slo_latency_ms or '-'}ms ttft<={args.slo_ttft_ms or '-'}ms"
+            f" target={args.slo_target:.0%} plateau={args.plateau:.0%}",
+            sep="\n",
+            file=sys.stderr,
+        )
+        print_sweep_header()
+        results, report = asyncio.run(
+            run_sweep(
+                client,
+                args.model,
+                prompts,
+                args.sweep,
+                args.num_requests,
+                slo_latency_ms=args.slo_latency_ms,
+                slo_ttft_ms=args.slo_ttft_ms,
+                slo_target=args.slo_target,
+                plateau=args.plateau,
+                stream=args.stream,
+            )
+        )
+        print(
+            f"max_sustainable_concurrency={report['max_sustainable_concurrency']}"
+            f"  stop_reason={report['stop_reason']}"
+        )
+        print_backend_summary(results, client)
+        if args.sweep_json:
+            with open(args.sweep_json, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Wrote {args.sweep_json}", file=sys.stderr)
+        else:
+            print(json.dumps(report, indent=2))
+        export_results(args, results, summarize(results))
+        return
+
+    if stages is not None:
+        print(
+            f"Open-loop {args.arrival} arrivals to {', '.join(args.url)}",
+            f"  model   : {args.model}",
+            f"  workers : {args.workers}",
+            f"  stages  : {', '.join(f'{r:g}/s' + (f' for {d:g}s' if d else '') for r, d in stages)}",
+            f"  max_tokens: {args.max_tokens}",
+            f"  workload: {describe_workload(args)}",
+            sep="\n",
+            file=sys.stderr,
+        )
+        if args.workers > 1:
+            results, elapsed_s, client.max_outstanding = run_workers(args, stages)
+        else:
+            results, elapsed_s = asyncio.run(
+                run_open_loop(
+                    client,
+                    args.model,
+                    prompts,
+                    stages,
+                    arrival=args.arrival,
+                    num_requests=None if args.ramp else args.num_requests,
+                    seed=args.seed,
+                    stream=args.stream,
+                )
+            )
+        if not args.quiet:
+            for r in results:
+                print(format_result(r))
+        summary = print_summary(results)
+        print_backend_summary(results, client)
+        print_open_loop_summary(results, stages, elapsed_s)
+        export_results(args, results, summary)
+        return
+
     print(
-        f"Sending {args.num_requests} request(s) to {args.url}",
+        f"Sending {args.num_requests} request(s) to {', '.join(args.url)}",
         f"  model   : {args.model}",
+        f"  workers : {args.workers}",
         f"  max_tokens: {args.max_tokens}",
-        f"  content : {args.content}",
+        f"  workload: {describe_workload(args)}",
         sep="\n",
         file=sys.stderr,
     )
 
-    results = asyncio.run(
-        run_parallel_requests(
-            args.url,
-            args.model,
-            args.content,
-            args.max_tokens,
-            args.num_requests,
+    if args.workers > 1:
+        results, _, client.max_outstanding = run_workers(args, None)
+    else:
+        results = asyncio.run(
+            run_parallel_requests(
+                client,
+                args.model,
+                prompts,
+                args.num_requests,
+                stream=args.stream,
+            )
         )
-    )
 
-    for r in results:
-        print(format_result(r))
+    if not args.quiet:
+        for r in results:
+            print(format_result(r))
 
-    print_summary(results)
+    summary = print_summary(results)
+    print_backend_summary(results, client)
+    export_results(args, results, summary)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,293 @@
+"""
+Prompt workloads for parallel_requests.py.
+
+Every workload is a lazy iterator of prompt dicts:
+  {"messages": [...], "max_tokens": int, "input_len": int | None, "output_len": int | None}
+
+Datasets are streamed one record at a time (JSONL, or a JSON array as used by
+ShareGPT dumps), so multi-GB files never sit in memory.
+"""
+
+import json
+import random
+import sys
+from typing import Iterator, TextIO
+
+# Short, common words that most tokenizers encode as a single token.
+WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be this "
+    "have from or one had by word but not what all were we when your can said there "
+    "use an each which she do how their if will up other about out many then them "
+    "these so some her would make like him into time has look two more write go see "
+    "number no way could people my than first water been call who oil its now find "
+    "long down day did get come made may part over new sound take only little work "
+    "know place year live me back give most very after thing our just name good"
+).split()
+
+
+def random_text(n_words: int, rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n_words))
+
+
+def load_tokenizer(name: str | None):
+    """Load a Hugging Face tokenizer, or None to fall back to a length estimate."""
+    if not name:
+        return None
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        print(
+            "transformers is not installed, estimating token counts from text length",
+            file=sys.stderr,
+        )
+        return None
+    return AutoTokenizer.from_pretrained(name, trust_remote_code=True)
+
+
+def count_tokens(tokenizer, text: str) -> int:
+    if tokenizer is None:
+        # Roughly 4 characters per token for English text.
+        return max(1, len(text) // 4)
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def fixed_prompts(content: str, max_tokens: int) -> Iterator[dict]:
+    """The same single-turn prompt forever (the original --content behaviour)."""
+    prompt = {
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": max_tokens,
+        "input_len": None,
+        "output_len": None,
+    }
+    while True:
+        yield prompt
+
+
+def parse_distribution(spec: str) -> tuple[str, list[float]]:
+    """
+    Parse a length distribution spec:
+      fixed:N | uniform:LOW:HIGH | normal:MEAN:STD | lognormal:MU:SIGMA
+    """
+    kind, *params = spec.split(":")
+    arity = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+    if kind not in arity or len(params) != arity[kind]:
+        raise ValueError(
+            f"invalid length distribution '{spec}', expected fixed:N, uniform:LOW:HIGH, "
+            f"normal:MEAN:STD or lognormal:MU:SIGMA"
+        )
+    return kind, [float(p) for p in params]
+
+
+def sample_length(dist: tuple[str, list[float]], rng: random.Random) -> int:
+    kind, params = dist
+    if kind == "fixed":
+        value = params[0]
+    elif kind == "uniform":
+        value = rng.uniform(*params)
+    elif kind == "normal":
+        value = rng.gauss(*params)
+    else:
+        value = rng.lognormvariate(*params)
+    return max(1, int(round(value)))
+
+
+def synthetic_prompts(
+    input_dist: tuple[str, list[float]],
+    output_dist: tuple[str, list[float]],
+    max_tokens: int,
+    tokenizer=None,
+    seed: int | None = None,
+) -> Iterator[dict]:
+    """
+    Random-word prompts whose lengths follow the given distributions.
+
+    Input lengths are in words (each about one token), output lengths in
+    tokens, capped at max_tokens. Prompts are random from the first word on,
+    so they never share a cached prefix.
+    """
+    rng = random.Random(seed)
+    while True:
+        target = sample_length(input_dist, rng)
+        text = random_text(target, rng)
+        output_len = min(sample_length(output_dist, rng), max_tokens)
+        yield {
+            "messages": [{"role": "user", "content": text}],
+            "max_tokens": output_len,
+            "input_len": count_tokens(tokenizer, text) if tokenizer else target,
+            "output_len": output_len,
+        }
+
+
+def iter_json_records(
+    f: TextIO,
+    chunk_size: int = 1 << 20,
+    max_record_size: int = 1 << 26,
+) -> Iterator[dict]:
+    """
+    Yield records from either a JSONL file or a top-level JSON array.
+
+    The array form is decoded incrementally with raw_decode over a rolling
+    buffer, so only one record (plus a chunk) is held in memory at a time.
+    Corrupt JSONL lines are skipped; in an array, a record that still doesn't
+    decode after max_record_size characters raises ValueError.
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size)
+    pos = 0
+    in_array = buffer.lstrip().startswith("[")
+    if in_array:
+        pos = buffer.index("[") + 1
+    while True:
+        # Skip separators between records.
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if in_array and pos < len(buffer) and buffer[pos] == "]":
+            return
+        if pos >= len(buffer):
+            buffer, pos = f.read(chunk_size), 0
+            if not buffer:
+                return
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            newline = buffer.find("\n", pos)
+            if not in_array and newline != -1:
+                # The whole line is in the buffer and still doesn't decode.
+                pos = newline + 1
+                continue
+            more = f.read(chunk_size)
+            if not more:
+                if in_array:
+                    raise
+                return
+            if len(buffer) - pos > max_record_size:
+                raise ValueError(f"record not valid JSON within {max_record_size} characters")
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield record
+        pos = end
+
+
+def record_to_conversation(record: dict) -> tuple[list[dict], str | None]:
+    """
+    Map a dataset record to (prompt messages, reference reply or None).
+
+    Supported shapes:
+      - ShareGPT: {"conversations": [{"from": "human", "value": ...}, {"from": "gpt", ...}]}
+      - OpenAI chat: {"messages": [{"role": ..., "content": ...}, ...]}
+      - Completion: {"prompt": ..., "completion"/"response"/"output": ...}
+      - Backlog/issue style: {"title": ..., "body": ...}
+    """
+    if "conversations" in record:
+        roles = {"human": "user", "user": "user", "gpt": "assistant", "assistant": "assistant", "system": "system"}
+        turns = [
+            {"role": roles.get(t.get("from"), "user"), "content": t.get("value", "")}
+            for t in record["conversations"]
+        ]
+    elif "messages" in record:
+        turns = [{"role": m["role"], "content": m.get("content") or ""} for m in record["messages"]]
+    elif "prompt" in record:
+        reply = record.get("completion") or record.get("response") or record.get("output")
+        return [{"role": "user", "content": record["prompt"]}], reply
+    elif "body" in record or "title" in record:
+        text = "\n\n".join(record[k] for k in ("title", "body") if record.get(k))
+        return [{"role": "user", "content": text}], None
+    else:
+        return [], None
+
+    # Prompt is everything up to and including the first user turn, the
+    # reference reply is the assistant turn that follows it.
+    for i, turn in enumerate(turns):
+        if turn["role"] == "user":
+            reply = turns[i + 1] if i + 1 < len(turns) else None
+            if reply is not None and reply["role"] == "assistant":
+                return turns[: i + 1], reply["content"]
+            return turns[: i + 1], None
+    return [], None
+
+
+def dataset_prompts(
+    path: str,
+    max_tokens: int,
+    tokenizer=None,
+) -> Iterator[dict]:
+    """
+    Stream prompts from a JSONL/JSON dataset, looping over the file forever.
+
+    The reference reply's token count becomes the request's max_tokens (capped
+    at max_tokens); records without a reply use max_tokens as-is.
+    """
+    while True:
+        yielded = 0
+        with open(path) as f:
+            for record in iter_json_records(f):
+                messages, reply = record_to_conversation(record)
+                if not messages or not messages[-1]["content"]:
+                    continue
+                output_len = count_tokens(tokenizer, reply) if reply else None
+                yield {
+                    "messages": messages,
+                    "max_tokens": min(output_len, max_tokens) if output_len else max_tokens,
+                    "input_len": sum(count_tokens(tokenizer, m["content"]) for m in messages),
+                    "output_len": output_len,
+                }
+                yielded += 1
+        if not yielded:
+            raise ValueError(f"no usable prompts in dataset '{path}'")
+
+
+def prefix_group(
+    kind: str,
+    prompt_len: int,
+    shared_fraction: float,
+    group_size: int,
+    max_tokens: int,
+    rng: random.Random,
+) -> list[dict]:
+    """
+    Build group_size prompts sharing one freshly generated prefix.
+
+    About shared_fraction of each prompt's prompt_len words is the common
+    prefix, laid out as a system prompt ("system"), a block of few-shot
+    question/answer pairs ("few-shot") or earlier conversation turns
+    ("multi-turn"); the rest is a unique final user turn. The prefix is random,
+    so the first prompt of a group always finds the prefix cache cold.
+    """
+    shared_len = round(prompt_len * shared_fraction)
+    unique_len = max(1, prompt_len - shared_len)
+
+    shared = []
+    if shared_len and kind == "system":
+        shared = [{"role": "system", "content": random_text(shared_len, rng)}]
+    elif shared_len:
+        # Few-shot examples are short question/long answer pairs, multi-turn
+        # history alternates turns of similar length.
+        turn_len = 64 if kind == "few-shot" else 32
+        remaining = shared_len
+        while remaining > 0:
+            question_len = min(remaining, turn_len // 4 if kind == "few-shot" else turn_len)
+            answer_len = min(remaining - question_len, turn_len)
+            prefix = ("Q: ", "A: ") if kind == "few-shot" else ("", "")
+            shared.append({"role": "user", "content": prefix[0] + random_text(question_len, rng)})
+            if answer_len:
+                shared.append(
+                    {"role": "assistant", "content": prefix[1] + random_text(answer_len, rng)}
+                )
+            remaining -= question_len + answer_len
+
+    # A question left without an answer starts the final user turn instead,
+    # so roles keep alternating; its words are still a shared prefix.
+    lead = ""
+    if shared and shared[-1]["role"] == "user":
+        lead = shared.pop()["content"] + "\n\n"
+
+    return [
+        {
+            "messages": shared + [{"role": "user", "content": lead + random_text(unique_len, rng)}],
+            "max_tokens": max_tokens,
+            "input_len": shared_len + unique_len,
+            "output_len": None,
+        }
+        for _ in range(group_size)
+    ]